@@ -0,0 +1,154 @@
+"""
+Ajuste dos parâmetros do índice HNSW da base vetorial.
+
+Varre combinações de `hnsw:M` e `hnsw:search_ef` sobre uma cópia em memória da
+coleção existente, mede a latência mediana de consulta (cada pergunta repetida
+REPEATS vezes) e o recall@k em relação à busca exata (força bruta) e escolhe a
+configuração mais rápida com recall mínimo. Com --write, grava o resultado em
+CHROMA_HNSW_M/CHROMA_HNSW_SEARCH_EF no init.py, mas só se for ao menos
+MIN_SPEEDUP mais rápida que a configuração atual.
+
+Uso:
+    python bench/tune_retriever.py [--questions perguntas.txt] [--write]
+"""
+import os
+import re
+import sys
+import time
+import argparse
+
+import numpy as np
+import chromadb
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from init import (  # noqa: E402
+    load_environment, RETRIEVER_FETCH_K, CHROMA_COLLECTION_METADATA, CHROMA_HNSW_M, CHROMA_HNSW_SEARCH_EF
+)
+from knowledge import load_vector_db  # noqa: E402
+
+INIT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "init.py")
+
+EF_VALUES = [40, 64, 80, 128]
+M_VALUES = [16, 32]
+MIN_RECALL = 0.9
+REPEATS = 20          # Execuções de cada pergunta; a latência é a mediana de todas
+MIN_SPEEDUP = 0.10    # Ganho mínimo sobre a configuração atual para regravar init.py
+BATCH_SIZE = 1000
+
+DEFAULT_QUESTIONS = [
+    "Qual o prazo para devolução de produtos com defeito?",
+    "Quais são meus direitos em caso de atraso na entrega?",
+    "Posso cancelar uma compra feita pela internet?",
+    "O que é propaganda enganosa?",
+    "Quem responde por vícios do produto?",
+    "Como funciona o direito de arrependimento?",
+    "O fornecedor pode cobrar taxa por boleto?",
+    "Quais informações devem constar no preço dos produtos?",
+]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Ajuste dos parâmetros HNSW do retriever')
+    parser.add_argument('--questions', help='Arquivo com uma pergunta por linha')
+    parser.add_argument('-k', type=int, default=RETRIEVER_FETCH_K,
+                        help='Número de vizinhos avaliados no recall@k')
+    parser.add_argument('--write', action='store_true',
+                        help='Grava a melhor configuração em init.py')
+    return parser.parse_args()
+
+
+def load_questions(path):
+    if not path:
+        return DEFAULT_QUESTIONS
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def exact_neighbors(vectors, queries, k):
+    """Vizinhos exatos por distância L2 (espaço padrão das coleções Chroma)."""
+    dists = (queries ** 2).sum(1)[:, None] - 2 * queries @ vectors.T + (vectors ** 2).sum(1)[None, :]
+    return np.argsort(dists, axis=1)[:, :k]
+
+
+def evaluate(vectors, queries, truth, k, hnsw_m, search_ef):
+    """Constrói uma coleção em memória com os parâmetros dados e mede latência e recall."""
+    client = chromadb.EphemeralClient()
+    collection = client.create_collection(
+        name=f"tune-m{hnsw_m}-ef{search_ef}",
+        metadata={**CHROMA_COLLECTION_METADATA, "hnsw:M": hnsw_m, "hnsw:search_ef": search_ef}
+    )
+    ids = [str(i) for i in range(len(vectors))]
+    for start in range(0, len(vectors), BATCH_SIZE):
+        collection.add(ids=ids[start:start + BATCH_SIZE],
+                       embeddings=vectors[start:start + BATCH_SIZE].tolist())
+
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        embedding = [query.tolist()]
+        # Execução de aquecimento, fora da medição
+        result = collection.query(query_embeddings=embedding, n_results=k, include=[])
+        for _ in range(REPEATS):
+            started = time.perf_counter()
+            collection.query(query_embeddings=embedding, n_results=k, include=[])
+            latencies.append(time.perf_counter() - started)
+        found = {int(i) for i in result["ids"][0]}
+        hits += len(found & set(expected.tolist()))
+
+    client.delete_collection(collection.name)
+    return float(np.median(latencies)), hits / (len(queries) * k)
+
+
+def write_config(config):
+    with open(INIT_PATH, 'r', encoding='utf-8') as f:
+        source = f.read()
+    for name, key in (("CHROMA_HNSW_M", "hnsw:M"), ("CHROMA_HNSW_SEARCH_EF", "hnsw:search_ef")):
+        source = re.sub(rf'^{name} = .*$', f'{name} = {config[key]}', source, count=1, flags=re.MULTILINE)
+    with open(INIT_PATH, 'w', encoding='utf-8') as f:
+        f.write(source)
+    print(f"init.py atualizado: CHROMA_HNSW_M = {config['hnsw:M']}, CHROMA_HNSW_SEARCH_EF = {config['hnsw:search_ef']}")
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    load_environment()
+
+    db = load_vector_db()
+    data = db._collection.get(include=["embeddings"])
+    vectors = np.asarray(data["embeddings"], dtype=np.float32)
+    if len(vectors) == 0:
+        sys.exit("A base vetorial está vazia. Execute main.py --update-only primeiro.")
+
+    k = min(args.k, len(vectors))
+    questions = load_questions(args.questions)
+    queries = np.asarray(db.embeddings.embed_documents(questions), dtype=np.float32)
+    truth = exact_neighbors(vectors, queries, k)
+    print(f"{len(vectors)} vetores, {len(questions)} perguntas, recall@{k}\n")
+
+    current = {"hnsw:M": CHROMA_HNSW_M, "hnsw:search_ef": CHROMA_HNSW_SEARCH_EF}
+    grid = [(m, ef) for m in M_VALUES for ef in EF_VALUES]
+    if (CHROMA_HNSW_M, CHROMA_HNSW_SEARCH_EF) not in grid:
+        grid.append((CHROMA_HNSW_M, CHROMA_HNSW_SEARCH_EF))
+
+    results = []
+    for hnsw_m, search_ef in grid:
+        latency, recall = evaluate(vectors, queries, truth, k, hnsw_m, search_ef)
+        results.append(({"hnsw:M": hnsw_m, "hnsw:search_ef": search_ef}, latency, recall))
+        print(f"M={hnsw_m:<3} ef={search_ef:<4} latência mediana={latency * 1000:7.3f} ms  recall={recall:.3f}")
+
+    candidates = [r for r in results if r[2] >= MIN_RECALL]
+    if not candidates:
+        sys.exit(f"\nNenhuma configuração atingiu recall >= {MIN_RECALL}.")
+    best, latency, recall = min(candidates, key=lambda r: r[1])
+    print(f"\nMelhor configuração: {best} (latência {latency * 1000:.3f} ms, recall {recall:.3f})")
+
+    if args.write:
+        _, current_latency, current_recall = next(r for r in results if r[0] == current)
+        if best == current:
+            print("A configuração atual já é a melhor; init.py não foi alterado.")
+        elif current_recall >= MIN_RECALL and latency > current_latency * (1 - MIN_SPEEDUP):
+            print(f"Ganho menor que {MIN_SPEEDUP:.0%} sobre a configuração atual "
+                  f"({current_latency * 1000:.3f} ms); init.py não foi alterado.")
+        else:
+            write_config(best)
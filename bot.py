@@ -1,97 +1,436 @@
+import asyncio
+import functools
+import hashlib
+import re
+import sys
+import time
+import unicodedata
+import uuid
+
+import httpx
+import tiktoken
+from prompt_toolkit import PromptSession
+from prompt_toolkit.patch_stdout import patch_stdout
+from langchain_chroma import Chroma
 from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
+from langchain_core.messages import SystemMessage
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableBranch, RunnableLambda, RunnablePassthrough
 
-from init import load_environment, LLM_MODEL
-from knowledge import get_or_create_db
+from init import (
+    load_environment, configure_llm_cache, LLM_MODEL, LLM_MODEL_STRONG, LLM_CACHE_ENABLED,
+    COMPLEX_QUESTION_MIN_WORDS, COMPLEX_QUESTION_KEYWORDS, LLM_MAX_TOKENS, LLM_STOP_SEQUENCES,
+    SEM_CACHE_ENABLED, SEM_CACHE_THRESHOLD, SEM_CACHE_TTL_SECONDS, SEM_CACHE_PATH,
+    RETRIEVER_USE_MMR, RETRIEVER_KWARGS, RETRIEVER_K, RETRIEVER_FETCH_K, RETRIEVER_LAMBDA_MULT,
+    MAX_CONTEXT_TOKENS
+)
+from knowledge import get_or_create_db, get_embeddings, FastMMRRetriever, _EMBED_CACHE_MODEL
 
-def configure_qa_chain(db):
-    """Configura a cadeia de QA com o modelo LLM usando a nova API da LangChain."""
-    # Inicializa o modelo LLM
-    llm = ChatOpenAI(model_name=LLM_MODEL, temperature=0.2)
-    
-    # Configura o retriever
-    retriever = db.as_retriever(
-        search_type="mmr",
-        # Recupera os 6 chunks mais relevantes para depois filtrar
-        # Recupera 10 documento
-        # Faz um balanceamento entre relevância e diversidade
-        search_kwargs={"k": 6, "fetch_k": 10, "lambda_mult": 0.7}
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Caracteres não aceitos em nomes de coleções do Chroma
+_COLLECTION_NAME_INVALID_RE = re.compile(r"[^A-Za-z0-9._-]")
+
+# Durante o streaming, o terminal é descarregado a cada N trechos ou ao fim de frase
+STREAM_FLUSH_EVERY = 4
+_SENTENCE_END = (".", "!", "?", ":", "\n")
+
+# Comandos que encerram o bot interativo
+EXIT_COMMANDS = ("sair", "exit", "quit", "finalizar")
+
+# Instruções fixas do assistente, enviadas como mensagem de sistema
+SYSTEM_PROMPT = (
+    "Você é advogado especialista em Direito do Consumidor brasileiro. "
+    "Responda apenas ao que foi perguntado, com base no contexto, citando os artigos e leis específicos, "
+    "explicando termos jurídicos em linguagem simples e indicando exceções; "
+    "em trocas de produtos, foque em prazos e condições. "
+    "Estruture em: Fundamentação Legal, Explicação Clara e Prazos e Procedimentos (quando aplicável)."
+)
+
+# Parte variável do prompt: trechos recuperados e pergunta do usuário
+HUMAN_PROMPT = "Contexto:\n{context}\n\nPergunta: {question}"
+
+# Identifica a versão do prompt; entra na chave do cache semântico para que
+# respostas geradas com instruções antigas não sejam reaproveitadas
+PROMPT_VERSION = hashlib.sha1((SYSTEM_PROMPT + "\0" + HUMAN_PROMPT).encode("utf-8")).hexdigest()[:12]
+
+# A mensagem de sistema é construída uma única vez e reaproveitada como objeto pronto;
+# a cada chamada só a parte variável (contexto e pergunta) é formatada
+_SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
+
+# O prompt é compilado uma única vez e compartilhado por todas as cadeias
+_PROMPT = ChatPromptTemplate.from_messages([_SYSTEM_MESSAGE, ("human", HUMAN_PROMPT)])
+
+
+# Configuração dos clientes HTTP das chamadas ao LLM: HTTP/2 e conexões
+# keep-alive evitam um novo handshake TCP+TLS a cada pergunta
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=50, max_connections=100, keepalive_expiry=60)
+_HTTP_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_http_client():
+    """Retorna o cliente HTTP/2 síncrono compartilhado (criado no primeiro uso)."""
+    return httpx.Client(http2=True, limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT)
+
+
+def new_async_http_client():
+    """
+    Cria um cliente HTTP/2 assíncrono para o event loop atual.
+
+    As conexões de um AsyncClient ficam presas ao loop em que foram abertas,
+    então cada loop (cada asyncio.run) usa o seu: crie-o com `async with`
+    dentro da corrotina e passe-o a build_qa_chain.
+    """
+    return httpx.AsyncClient(http2=True, limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_encoding():
+    """Retorna o tokenizador do modelo LLM (carregado uma única vez)."""
+    try:
+        return tiktoken.encoding_for_model(LLM_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def pack_context(docs):
+    """
+    Junta os trechos recuperados em um único contexto limitado a MAX_CONTEXT_TOKENS.
+
+    Os documentos chegam do retriever em ordem de relevância, então os mais
+    relevantes são mantidos e os demais descartados quando o limite é atingido.
+    """
+    enc = _get_encoding()
+    out, used = [], 0
+    for doc in docs:
+        tokens = enc.encode(doc.page_content)
+        if used + len(tokens) > MAX_CONTEXT_TOKENS:
+            # Garante ao menos o trecho mais relevante, truncado ao limite
+            if not out:
+                out.append(enc.decode(tokens[:MAX_CONTEXT_TOKENS]))
+            break
+        out.append(doc.page_content)
+        used += len(tokens)
+    return "\n---\n".join(out)
+
+
+@functools.lru_cache(maxsize=4)
+def get_llm(model_name=LLM_MODEL, cached=False):
+    """
+    Retorna a instância única do modelo LLM indicado, para uso síncrono.
+
+    A construção é adiada até o primeiro uso porque depende da API key
+    carregada por load_environment(); depois disso o mesmo cliente HTTP
+    (e seu pool de conexões) é reaproveitado em todas as consultas.
+    """
+    return build_llm(model_name, cached)
+
+
+def build_llm(model_name=LLM_MODEL, cached=False, http_async_client=None):
+    """
+    Cria uma instância do modelo LLM indicado.
+
+    `http_async_client` deve pertencer ao event loop em que o modelo será
+    usado (veja new_async_http_client); sem ele, o modelo serve apenas às
+    chamadas síncronas.
+
+    O cache de respostas do LLM só é consultado por invoke; stream/astream
+    sempre chamam a API. Por isso só as instâncias com cached=True (usadas via
+    invoke por query_rag e pelo Streamlit) fixam temperature=0 para que respostas
+    repetidas sejam estáveis; as de streaming mantêm temperature=0.2 sem cache.
+    """
+    use_cache = cached and LLM_CACHE_ENABLED
+    if use_cache:
+        configure_llm_cache()
+    # streaming=True permite que astream_rag receba os tokens à medida que são gerados
+    return ChatOpenAI(
+        model_name=model_name,
+        temperature=0 if use_cache else 0.2,
+        streaming=True,
+        cache=None if use_cache else False,
+        # Limita o tamanho da resposta, que determina o tempo de decodificação
+        max_tokens=LLM_MAX_TOKENS,
+        stop=LLM_STOP_SEQUENCES,
+        max_retries=2,
+        timeout=_HTTP_TIMEOUT,
+        http_client=_get_http_client(),
+        http_async_client=http_async_client
     )
-    
-    # Template do prompt usando o formato de chat
-    template = """
-    Você é um advogado especialista em Direito do Consumidor brasileiro, com profundo conhecimento do CDC e em 
-    algumas outras legislações existentes as quais estão disponíveis na pasta legislaçao.
 
-    Contexto do CDC:
-    {context}
 
-    Pergunta do usuário: {question}
+def normalize_question(question):
+    """
+    Normaliza a pergunta (Unicode NFKC, espaços e caixa) antes dos caches e da busca.
+
+    Variações incidentais na digitação passam a gerar a mesma chave de cache.
+    """
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFKC", question)).strip().lower()
+
+
+def is_complex_question(question):
+    """Heurística barata para decidir se a pergunta precisa do modelo mais forte."""
+    text = question.lower()
+    if len(text.split()) >= COMPLEX_QUESTION_MIN_WORDS:
+        return True
+    return any(keyword in text for keyword in COMPLEX_QUESTION_KEYWORDS)
+
+
+@functools.lru_cache(maxsize=4)
+def configure_qa_chain(db, streaming=False):
+    """
+    Configura a cadeia de QA com o modelo LLM usando a nova API da LangChain.
+
+    A cadeia é compartilhada e se destina às chamadas síncronas (query_rag e o
+    Streamlit); para invoke, stream ou abatch em um event loop, use build_qa_chain
+    com um cliente criado por new_async_http_client.
+    """
+    return build_qa_chain(db, streaming)
 
-    Siga estas instruções rigorosamente:
-    1. Responda EXATAMENTE à pergunta feita, sem desviar para tópicos relacionados mas não solicitados
-    2. Se a pergunta for sobre troca de produtos, foque em prazos e condições para troca, não apenas em defeitos
-    3. Cite os artigos ESPECÍFICOS do CDC e das legislacoes da pasta lesgislacao que tratam do assunto perguntado
-    4. Estruture sua resposta em tópicos para facilitar a compreensão
-    5. Sempre explique os termos técnicos jurídicos em linguagem simples
-    6. Quando existirem exceções à regra, mencione-as claramente
 
-    Responda de forma estruturada com:
-    - Fundamentação Legal: [artigos exatos do CDC que respondem a pergunta]
-    - Explicação Clara: [explicação dos direitos do consumidor neste caso específico]
-    - Prazos e Procedimentos: [quando aplicável]
+def build_qa_chain(db, streaming=False, http_async_client=None):
     """
+    Monta a cadeia de QA (retriever, roteamento de modelo e LLM).
 
-    # Cria o prompt formatado
-    prompt = ChatPromptTemplate.from_template(template)
+    Com streaming=True a cadeia se destina a astream_rag e não usa o cache de
+    respostas do LLM (que só vale para invoke); caso contrário usa o cache e
+    temperature=0. Com `http_async_client` os modelos são criados para o event
+    loop daquele cliente, em vez das instâncias compartilhadas de get_llm.
+    """
+    # Configura o retriever conforme init.py
+    if RETRIEVER_USE_MMR:
+        # MMR com matriz de similaridade pré-calculada
+        retriever = FastMMRRetriever(
+            vectorstore=db,
+            k=RETRIEVER_K,
+            fetch_k=RETRIEVER_FETCH_K,
+            lambda_mult=RETRIEVER_LAMBDA_MULT
+        )
+    else:
+        # Apenas relevância: evita o reranqueamento O(fetch_k²) do MMR
+        retriever = db.as_retriever(**RETRIEVER_KWARGS)
     
+    # Perguntas simples usam o modelo padrão; as complexas, o modelo mais forte
+    cached = not streaming
+    if http_async_client is None:
+        llm_simple, llm_strong = get_llm(LLM_MODEL, cached), get_llm(LLM_MODEL_STRONG, cached)
+    else:
+        llm_simple = build_llm(LLM_MODEL, cached, http_async_client)
+        llm_strong = build_llm(LLM_MODEL_STRONG, cached, http_async_client)
+    answer_simple = _PROMPT | llm_simple | StrOutputParser()
+    answer_complex = _PROMPT | llm_strong | StrOutputParser()
+
     # Define a cadeia usando o novo formato de sequência LCEL (LangChain Expression Language)
     qa_chain = (
-        {"context": retriever, "question": RunnablePassthrough()}
-        | prompt
-        | llm
-        | StrOutputParser()
+        RunnableLambda(normalize_question)
+        | {"context": retriever | RunnableLambda(pack_context), "question": RunnablePassthrough()}
+        | RunnableBranch(
+            (lambda inputs: is_complex_question(inputs["question"]), answer_complex),
+            answer_simple
+        )
     )
     
     return qa_chain
 
-def query_rag(qa_chain, user_question):
+def load_semantic_cache():
+    """
+    Carrega (ou cria) a coleção Chroma usada como cache semântico de respostas.
+
+    A coleção é separada por modelo e dimensão dos embeddings (a mesma chave do
+    cache de embeddings): ao mudar EMBED_DIMENSIONS o cache começa vazio em vez
+    de falhar com vetores de tamanho diferente.
+    """
+    return Chroma(
+        collection_name="semantic_cache_" + _COLLECTION_NAME_INVALID_RE.sub("_", _EMBED_CACHE_MODEL),
+        persist_directory=SEM_CACHE_PATH,
+        embedding_function=get_embeddings(),
+        collection_metadata={"hnsw:space": "cosine"}
+    )
+
+def lookup_semantic_cache(cache, user_question):
+    """
+    Procura no cache semântico uma pergunta equivalente à do usuário.
+
+    Returns:
+        tuple: (resposta em cache ou None, embedding da pergunta)
+    """
+    # A pergunta é embutida uma única vez e o vetor é reaproveitado ao gravar no cache
+    vector = cache.embeddings.embed_query(normalize_question(user_question))
+    results = cache.similarity_search_by_vector_with_relevance_scores(
+        vector, k=1, filter={"prompt_version": PROMPT_VERSION}
+    )
+    if results:
+        doc, distance = results[0]
+        is_fresh = time.time() - doc.metadata.get("created_at", 0) <= SEM_CACHE_TTL_SECONDS
+        if distance <= SEM_CACHE_THRESHOLD and is_fresh:
+            return doc.metadata.get("answer"), vector
+    return None, vector
+
+def store_semantic_cache(cache, user_question, vector, answer):
+    """Grava a resposta no cache semântico reaproveitando o embedding já calculado."""
+    cache._collection.add(
+        ids=[uuid.uuid4().hex],
+        embeddings=[vector],
+        documents=[normalize_question(user_question)],
+        metadatas=[{
+            "answer": answer,
+            "raw_question": user_question,
+            "created_at": time.time(),
+            "prompt_version": PROMPT_VERSION
+        }]
+    )
+
+def query_rag(qa_chain, user_question, semantic_cache=None):
     """Consulta o sistema RAG com uma pergunta usando a nova API."""
     try:
+        vector = None
+        if semantic_cache is not None:
+            cached, vector = lookup_semantic_cache(semantic_cache, user_question)
+            if cached is not None:
+                return {"result": cached}
+
         # Invoca a cadeia com a pergunta do usuário
         result = qa_chain.invoke(user_question)
+
+        if semantic_cache is not None:
+            store_semantic_cache(semantic_cache, user_question, vector, result)
         return {"result": result}
     except Exception as e:
         # Em caso de erro, retorna uma mensagem de erro como resultado
         return {"result": f"Erro ao processar a pergunta: {str(e)}"}
 
-def run_bot():
-    """Executa o bot interativo para responder perguntas sobre Direito do Consumidor."""
+async def query_rag_batch(db, user_questions, concurrency=16):
+    """
+    Consulta o sistema RAG com várias perguntas de forma concorrente.
+
+    Útil para avaliação em lote: as recuperações e chamadas ao LLM de cada
+    pergunta são disparadas em paralelo, limitadas por `concurrency`.
+    A cadeia e seu cliente HTTP assíncrono são criados no loop da chamada.
+    Exemplo: asyncio.run(query_rag_batch(db, perguntas)).
+
+    Returns:
+        list: Um dicionário {"result": ...} por pergunta, na mesma ordem
+    """
+    async with new_async_http_client() as http_async_client:
+        qa_chain = build_qa_chain(db, http_async_client=http_async_client)
+        results = await qa_chain.abatch(
+            list(user_questions),
+            config={"max_concurrency": concurrency},
+            return_exceptions=True
+        )
+    return [
+        {"result": f"Erro ao processar a pergunta: {str(r)}"} if isinstance(r, Exception) else {"result": r}
+        for r in results
+    ]
+
+async def astream_rag(qa_chain, user_question, semantic_cache=None):
+    """
+    Consulta o sistema RAG exibindo a resposta no terminal à medida que é gerada.
+
+    Usada pelo bot interativo, com uma cadeia criada por build_qa_chain(db,
+    streaming=True): o stream não passa pelo cache de respostas do LLM, só
+    pelo cache semântico.
+    """
+    parts = []
+    try:
+        vector = None
+        if semantic_cache is not None:
+            cached, vector = await asyncio.to_thread(lookup_semantic_cache, semantic_cache, user_question)
+            if cached is not None:
+                sys.stdout.write(cached + "\n")
+                sys.stdout.flush()
+                return {"result": cached}
+
+        write, flush = sys.stdout.write, sys.stdout.flush
+        async for chunk in qa_chain.astream(user_question):
+            write(chunk)
+            parts.append(chunk)
+            # Descarrega a cada STREAM_FLUSH_EVERY trechos ou ao fim de uma frase
+            if len(parts) % STREAM_FLUSH_EVERY == 0 or chunk.endswith(_SENTENCE_END):
+                flush()
+
+        if semantic_cache is not None:
+            await asyncio.to_thread(store_semantic_cache, semantic_cache, user_question, vector, "".join(parts))
+    except Exception as e:
+        # Em caso de erro, exibe a mensagem no lugar do restante da resposta
+        error_message = f"Erro ao processar a pergunta: {str(e)}"
+        sys.stdout.write(error_message)
+        parts.append(error_message)
+    sys.stdout.write("\n")
+    sys.stdout.flush()
+    return {"result": "".join(parts)}
+
+async def arun_bot():
+    """
+    Executa o bot interativo de forma assíncrona.
+
+    A leitura das perguntas roda em paralelo com a geração da resposta, então o
+    usuário pode digitar a próxima pergunta enquanto a atual ainda é exibida;
+    as perguntas são respondidas na ordem em que foram enviadas.
+    """
     # Carrega o ambiente
     load_environment()
     
     # Obtém ou cria o banco de dados vetorial
     db = get_or_create_db()
     
-    # Configura a cadeia QA
-    qa_chain = configure_qa_chain(db)
+    # Configura a cadeia QA (as respostas são transmitidas com astream); o
+    # cliente HTTP assíncrono pertence a este event loop e é fechado ao sair
+    http_async_client = new_async_http_client()
+    qa_chain = build_qa_chain(db, streaming=True, http_async_client=http_async_client)
+
+    # Cache semântico de respostas para perguntas parafraseadas
+    semantic_cache = load_semantic_cache() if SEM_CACHE_ENABLED else None
     
     print("\n=== Assistente Virtual sobre Direito do Consumidor ===")
     print("Digite suas perguntas sobre Direito do Consumidor ou 'finalizar' para encerrar.\n")
-    
-    while True:
-        question = input("Pergunta: ")
-        if question.lower() in ["sair", "exit", "quit", "finalizar"]:
-            break
-        
-        print("\nProcessando pergunta, por favor aguarde...")
-        response = query_rag(qa_chain, question)
-        
-        print("\nResposta:")
-        print(response["result"])
-        print("\n" + "-"*80 + "\n")
+
+    session = PromptSession()
+    questions = asyncio.Queue()
+
+    async def read_questions():
+        while True:
+            try:
+                question = await session.prompt_async("Pergunta: ")
+            except (EOFError, KeyboardInterrupt):
+                question = "sair"
+            await questions.put(question)
+            if question.lower() in EXIT_COMMANDS:
+                return
+
+    async with http_async_client:
+        # patch_stdout mantém a linha de entrada intacta enquanto a resposta é impressa
+        with patch_stdout():
+            reader = asyncio.create_task(read_questions())
+            try:
+                while True:
+                    # Se o leitor terminou e não há perguntas pendentes, propaga seu erro
+                    if questions.empty() and reader.done():
+                        reader.result()
+                        break
+
+                    # Aguarda a próxima pergunta ou o fim do leitor, o que vier primeiro
+                    getter = asyncio.ensure_future(questions.get())
+                    await asyncio.wait({reader, getter}, return_when=asyncio.FIRST_COMPLETED)
+                    if not getter.done():
+                        getter.cancel()
+                        continue
+
+                    question = getter.result()
+                    if question.lower() in EXIT_COMMANDS:
+                        break
+
+                    print("\nResposta:")
+                    await astream_rag(qa_chain, question, semantic_cache=semantic_cache)
+                    print("\n" + "-"*80 + "\n")
+            finally:
+                reader.cancel()
+                await asyncio.gather(reader, return_exceptions=True)
+
+def run_bot():
+    """Executa o bot interativo para responder perguntas sobre Direito do Consumidor."""
+    asyncio.run(arun_bot())
 
 # Ponto de entrada se o script for executado diretamente
 if __name__ == "__main__":
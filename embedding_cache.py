@@ -0,0 +1,67 @@
+import hashlib
+import os
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+
+from init import EMBED_CACHE_PATH, EMBED_HALF_PRECISION
+
+# Limite de parâmetros por consulta do SQLite (com margem)
+_SQLITE_MAX_PARAMS = 900
+
+# Precisão dos vetores gravados; float16 ocupa metade do espaço em disco
+_STORAGE_DTYPE = np.float16 if EMBED_HALF_PRECISION else np.float32
+
+
+def _text_hash(model, text):
+    """Chave do cache: SHA-256 do modelo e do texto."""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()
+
+
+def _connect(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS cache (hash BLOB PRIMARY KEY, vec BLOB NOT NULL)")
+    return conn
+
+
+def get_or_compute(texts, model, embed_fn, path=EMBED_CACHE_PATH):
+    """
+    Retorna os embeddings dos textos, calculando apenas os que não estão em cache.
+
+    Os vetores ficam em um SQLite indexado pelo SHA-256 de `model` + texto;
+    os textos ausentes (sem repetição) são enviados a `embed_fn` em uma única
+    chamada e gravados em uma só transação. O resultado é uma matriz float32
+    (uma linha por texto), mesmo quando o cache é gravado em float16.
+    """
+    hashes = [_text_hash(model, text) for text in texts]
+    found = {}
+
+    with closing(_connect(path)) as conn:
+        unique_hashes = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique_hashes), _SQLITE_MAX_PARAMS):
+            window = unique_hashes[start:start + _SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(window))
+            rows = conn.execute(f"SELECT hash, vec FROM cache WHERE hash IN ({placeholders})", window)
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=_STORAGE_DTYPE)
+
+        # Textos ausentes do cache, sem repetição
+        missing = {}
+        for key, text in zip(hashes, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = np.asarray(embed_fn(list(missing.values())), dtype=_STORAGE_DTYPE)
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO cache (hash, vec) VALUES (?, ?)",
+                    [(key, vec.tobytes()) for key, vec in zip(missing, vectors)]
+                )
+            found.update(zip(missing, vectors))
+
+    if not hashes:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.asarray([found[key] for key in hashes], dtype=np.float32)
@@ -1,6 +1,16 @@
 import os
+import functools
 from dotenv import load_dotenv
-import fitz
+
+# Carrega o .env antes de ler as opções abaixo, para que também possam ser
+# definidas nele (load_environment() recarrega com override mais tarde)
+load_dotenv()
+
+
+def env_flag(name):
+    """Lê uma opção booleana do ambiente: 1/true/yes/on/sim ativam, o resto desativa."""
+    return os.getenv(name, "").strip().lower() in ("1", "true", "yes", "on", "sim")
+
 
 def load_environment():
     """Carrega variáveis de ambiente e verifica a API key."""
@@ -10,35 +20,90 @@ def load_environment():
     if not os.getenv("OPENAI_API_KEY"):
         raise ValueError("A API key da OpenAI não está configurada. Adicione-a ao arquivo .env")
 
-    #print(f"API KEY carregada: {'*' * 4}{os.getenv('OPENAI_API_KEY')[-4:] if os.getenv('OPENAI_API_KEY') else 'Não Encontrada'}")
-    print(f"API KEY carregada: {'*' * 4}{os.getenv('OPENAI_API_KEY')[-4:] if os.getenv('OPENAI_API_KEY') else 'Não Encontrada'}")
+    ensure_directories()
+
+
+@functools.lru_cache(maxsize=1)
+def configure_llm_cache():
+    """
+    Ativa o cache local (SQLite) de respostas do LLM para perguntas repetidas.
+
+    Chamada pelo bot ao criar o primeiro modelo com cache (caminhos via invoke);
+    as chamadas seguintes não fazem nada.
+    """
+    # Importados aqui para que `import init` não carregue o langchain_community
+    from langchain_core.globals import set_llm_cache
+    from langchain_community.cache import SQLiteCache
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    set_llm_cache(SQLiteCache(database_path=LLM_CACHE_PATH))
 
 
 # Configurações globais
 EMBED_MODEL = "text-embedding-3-small"  # Modelo de embeddings mais recente
-LLM_MODEL = "gpt-3.5-turbo"             # Modelo LLM
+EMBED_DIMENSIONS = None                 # Dimensões dos vetores (None = 1536; ex.: 512 encolhe o índice a 1/3, exige recriar a base)
+EMBED_BATCH_SIZE = 1024                 # Textos enviados por requisição de embeddings (máx. da API: 2048)
+EMBED_MAX_CONCURRENCY = 16              # Requisições de embeddings simultâneas durante a indexação
+QUERY_EMBED_CACHE_SIZE = 4096           # Embeddings de consultas mantidos em memória (LRU)
+EMBED_HALF_PRECISION = env_flag("HALF_PRECISION")  # Guarda o cache de embeddings em float16 (metade do espaço)
+LLM_MODEL = "gpt-4o-mini"               # Modelo LLM padrão (perguntas simples)
+LLM_MODEL_STRONG = "gpt-4o"             # Modelo LLM para perguntas complexas
+COMPLEX_QUESTION_MIN_WORDS = 40         # Perguntas a partir deste tamanho vão para o modelo forte
+# Só marcadores de análise comparativa ou jurisprudencial vão para o modelo forte;
+# temas comuns de consumo (contrato, indenização, cláusula abusiva, responsabilidade)
+# aparecem na maioria das perguntas e ficam com o modelo padrão
+COMPLEX_QUESTION_KEYWORDS = (
+    "diferença entre", "jurisprud", "precedente", "comparar", "comparação"
+)
+LLM_MAX_TOKENS = 600                    # Limite de tokens da resposta (respostas típicas têm 300-500)
+LLM_STOP_SEQUENCES = ["\n\n---", "\nPergunta:"]  # Interrompem gerações que extrapolam a resposta
 CHUNK_SIZE = 750                        # Tamanho dos chunks de texto otimizado para textos jurídicos
 CHUNK_OVERLAP = 150                     # Sobreposição entre chunks
+VERBOSE = env_flag("VERBOSE")           # Ativa mensagens de diagnóstico detalhadas
+PDF_PARALLEL_MIN_PAGES = 64             # PDFs a partir deste tamanho são extraídos em faixas de páginas paralelas
+LLM_CACHE_ENABLED = True                # Reaproveita respostas do LLM para perguntas idênticas
+EMBED_CACHE_ENABLED = True              # Reaproveita embeddings de chunks já indexados
+SEM_CACHE_ENABLED = True                # Reaproveita respostas para perguntas parafraseadas
+SEM_CACHE_THRESHOLD = 0.05              # Distância de cosseno máxima para considerar a pergunta equivalente
+SEM_CACHE_TTL_SECONDS = 7 * 24 * 3600   # Validade de uma resposta no cache semântico
+
+# Configuração do retriever
+RETRIEVER_K = 4                         # Número de chunks enviados ao LLM
+RETRIEVER_USE_MMR = False               # Ativa o MMR (FastMMRRetriever); o padrão é busca por similaridade
+RETRIEVER_FETCH_K = 10                  # Candidatos avaliados pelo MMR (quando ativo)
+RETRIEVER_LAMBDA_MULT = 0.7             # Balanço relevância/diversidade do MMR
+RETRIEVER_KWARGS = {"search_type": "similarity", "search_kwargs": {"k": RETRIEVER_K}}
+MAX_CONTEXT_TOKENS = 1500               # Limite de tokens dos trechos enviados ao LLM
+
+# Parâmetros do índice HNSW da coleção Chroma. M e search_ef são ajustados com
+# bench/tune_retriever.py; construction_ef melhora a qualidade do grafo na indexação e
+# batch_size/sync_threshold agrupam inserções em lote antes de atualizar o índice.
+# Só têm efeito ao criar a coleção; para aplicá-los a uma base existente use --clear-db.
+CHROMA_HNSW_M = 16
+CHROMA_HNSW_SEARCH_EF = 64
+CHROMA_COLLECTION_METADATA = {
+    "hnsw:M": CHROMA_HNSW_M,
+    "hnsw:search_ef": CHROMA_HNSW_SEARCH_EF,
+    "hnsw:construction_ef": 128,
+    "hnsw:batch_size": 1000,
+    "hnsw:sync_threshold": 2000,
+    "hnsw:num_threads": os.cpu_count() or 1,
+}
 
 # Diretórios e caminhos
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # Diretório base do projeto
 LEGISLACAO_DIR = os.path.join(BASE_DIR, "legislacao")  # Diretório com as legislações
 DB_PATH = os.path.join(BASE_DIR, "chroma_db")          # Diretório para o banco de dados Chroma
-
-# Em init.py
-import os
-
-# Obter o diretório do script atual (src)
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-
-# Subir um nível para obter o diretório raiz do projeto
-BASE_DIR = os.path.dirname(SCRIPT_DIR)
-
-# Definir o caminho para a pasta legislacao
-LEGISLACAO_DIR = os.path.join(BASE_DIR, "legislacao")
-
-print(f"BASE_DIR: {BASE_DIR}")
-print(f"LEGISLACAO_DIR: {LEGISLACAO_DIR}")
+CACHE_DIR = os.path.join(BASE_DIR, ".cache")           # Diretório para caches locais (fora do DB_PATH)
+LLM_CACHE_PATH = os.path.join(CACHE_DIR, "llm_cache.sqlite")  # Cache de respostas do LLM
+SEM_CACHE_PATH = os.path.join(CACHE_DIR, "semantic_cache")    # Cache semântico de perguntas/respostas
+PDF_TEXT_CACHE_DIR = os.path.join(CACHE_DIR, "pdf_text")      # Texto já extraído dos PDFs
+EMBED_CACHE_PATH = os.path.join(CACHE_DIR, "embed_cache_f16.sqlite" if EMBED_HALF_PRECISION
+                                else "embed_cache.sqlite")      # Embeddings já calculados dos chunks
+
+if VERBOSE:
+    print(f"BASE_DIR: {BASE_DIR}")
+    print(f"LEGISLACAO_DIR: {LEGISLACAO_DIR}")
 
 def list_available_files():
     """Lista todos os arquivos disponíveis na pasta de legislação."""
@@ -48,18 +113,25 @@ def list_available_files():
         if os.path.isfile(file_path):
             print(f"  - {filename} ({os.path.getsize(file_path)} bytes)")
 
-# Certifica que o diretório de legislações existe
-if not os.path.exists(LEGISLACAO_DIR):
-    os.makedirs(LEGISLACAO_DIR)
-    print(f"Diretório de legislações criado: {LEGISLACAO_DIR}")
-
-# Certifica que o diretório do banco de dados existe
-if not os.path.exists(DB_PATH):
-    os.makedirs(DB_PATH)
-    print(f"Diretório do banco de dados criado: {DB_PATH}")
+def ensure_directories():
+    """Certifica que os diretórios de legislações e do banco de dados existem."""
+    for label, path in (("legislações", LEGISLACAO_DIR), ("banco de dados", DB_PATH)):
+        if not os.path.exists(path):
+            os.makedirs(path)
+            print(f"Diretório de {label} criado: {path}")
 
 
 # Mapeamento de documentos
+@functools.lru_cache(maxsize=1)
+def get_documento_paths():
+    """
+    Retorna o dicionário de documentos disponíveis (título -> caminho).
+
+    A pasta de legislação só é listada na primeira chamada, e não ao importar
+    o módulo; use get_documento_paths.cache_clear() para forçar nova leitura.
+    """
+    return build_document_paths()
+
 def build_document_paths():
     """Constrói o dicionário de documentos com base nos arquivos disponíveis na pasta de legislação."""
     documento_paths = {}
@@ -81,6 +153,9 @@ def build_document_paths():
         "CNSP_296.pdf": "Resolução CNSP n. 296"
     }
     
+    if not os.path.isdir(LEGISLACAO_DIR):
+        return documento_paths
+
     # Verifica os arquivos disponíveis na pasta
     for filename in os.listdir(LEGISLACAO_DIR):
         filepath = os.path.join(LEGISLACAO_DIR, filename)
@@ -95,31 +170,6 @@ def build_document_paths():
     
     return documento_paths
 
-# Verifica os documentos disponíveis e inclui na base
-DOCUMENTO_PATHS = build_document_paths()
-
-def extract_text_from_pdf(pdf_path):
-    """Extrai texto do arquivo PDF."""
-    # Verificação explícita
-    if not os.path.exists(pdf_path):
-        raise FileNotFoundError(f"Arquivo não encontrado: {pdf_path}")
-        
-    # Imprime informações para debug
-    print(f"Abrindo arquivo: {pdf_path}")
-    print(f"Arquivo existe: {os.path.exists(pdf_path)}")
-    print(f"Tamanho do arquivo: {os.path.getsize(pdf_path)} bytes")
-    
-    try:
-        doc = fitz.open(pdf_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        return text
-    except Exception as e:
-        print(f"Erro ao abrir o PDF {pdf_path}: {str(e)}")
-        print(f"Tipo do erro: {type(e)}")
-        raise
-
 def diagnose_paths():
     """Diagnostica problemas com caminhos de arquivos."""
     print("\n=== Diagnóstico de Caminhos ===")
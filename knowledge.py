@@ -1,12 +1,181 @@
+import hashlib
 import os
 import re
+import tempfile
 import fitz  # PyMuPDF
-from io import BytesIO 
+import httpx
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import List
+try:
+    import PyPDF2  # Alternativa para PDFs que o PyMuPDF não consegue abrir
+except ImportError:
+    PyPDF2 = None
+from pydantic import ConfigDict
 from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
 from langchain_openai import OpenAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores.utils import filter_complex_metadata
-from init import EMBED_MODEL, CHUNK_SIZE, CHUNK_OVERLAP, DB_PATH, DOCUMENTO_PATHS
+from embedding_cache import get_or_compute
+from init import get_documento_paths, EMBED_MODEL, EMBED_DIMENSIONS, EMBED_BATCH_SIZE, EMBED_MAX_CONCURRENCY, EMBED_CACHE_ENABLED, QUERY_EMBED_CACHE_SIZE, CHUNK_SIZE, CHUNK_OVERLAP, DB_PATH, VERBOSE, PDF_TEXT_CACHE_DIR, PDF_PARALLEL_MIN_PAGES, CHROMA_COLLECTION_METADATA
+
+# Extração em texto puro: mantém espaços e o recorte da página, sem preservar
+# ligaduras nem imagens, evitando etapas de análise desnecessárias para a divisão por artigos.
+# Palavras hifenizadas na quebra de linha são reunidas, o que ajuda as expressões regulares
+_PDF_TEXT_FLAGS = fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_MEDIABOX_CLIP | fitz.TEXT_DEHYPHENATE
+
+# Expressões regulares compiladas uma única vez no carregamento do módulo
+_WS_RE = re.compile(r'\s+')
+_CTRL_RE = re.compile(r'[\x00-\x1F\x7F-\x9F]')
+_ART_NUM_RE = re.compile(r'Art\.\s*(\d+)')
+_CHAPTER_RE = re.compile(r'CAPÍTULO\s+([IVX]+|\d+)', re.IGNORECASE)
+_TITLE_RE = re.compile(r'TÍTULO\s+([IVX]+|\d+)', re.IGNORECASE)
+# Cabeçalhos de artigo; o corpo de cada artigo vai até o cabeçalho seguinte
+_ARTICLE_HEADER_RE = re.compile(r'Art\.?\s*(\d+[º°]?[A-Z]?)[.\s-]+')
+_DOC_NUMBER_RE = re.compile(r'(?:n[º°.]?\s*)([\d\.]+)(?:/(\d{4}))?')
+_MONTHS = {
+    'janeiro': '01', 'fevereiro': '02', 'março': '03', 'abril': '04',
+    'maio': '05', 'junho': '06', 'julho': '07', 'agosto': '08',
+    'setembro': '09', 'outubro': '10', 'novembro': '11', 'dezembro': '12'
+}
+_DATE_RE = re.compile(r'(\d{1,2})\s+de\s+(' + '|'.join(_MONTHS) + r')\s+de\s+(\d{4})', re.IGNORECASE)
+# A data de promulgação fica no cabeçalho; só o início do texto é examinado
+_META_SCAN_CHARS = 4096
+
+# Divisor de texto compartilhado: criado uma única vez em vez de a cada documento ou artigo
+_DEFAULT_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    length_function=len,
+    separators=["\n\n", "\n", ". ", " ", ""]
+)
+
+# Identifica o modelo no cache de embeddings; vetores truncados não se misturam aos completos
+_EMBED_CACHE_MODEL = EMBED_MODEL if EMBED_DIMENSIONS is None else f"{EMBED_MODEL}@{EMBED_DIMENSIONS}"
+
+
+class CachedQueryEmbeddings(OpenAIEmbeddings):
+    """OpenAIEmbeddings que reaproveita o embedding de consultas já vistas (LRU em memória)."""
+
+    def embed_query(self, text: str) -> List[float]:
+        return list(_embed_query_cached(text))
+
+
+@lru_cache(maxsize=QUERY_EMBED_CACHE_SIZE)
+def _embed_query_cached(text):
+    # Tupla para que o vetor guardado no cache não possa ser alterado por quem o recebe
+    return tuple(OpenAIEmbeddings.embed_query(get_embeddings(), text))
+
+
+@lru_cache(maxsize=1)
+def get_embeddings():
+    """
+    Retorna o modelo de embeddings compartilhado, configurado para lotes grandes.
+
+    Todas as coleções Chroma usam esta instância, então uma pergunta repetida
+    (no retriever ou no cache semântico) é embutida uma única vez. Os lotes
+    compartilham um cliente HTTP/2 com keep-alive, sem novo handshake TCP+TLS
+    por requisição, com conexões para todas as requisições simultâneas.
+    Só o cliente síncrono é configurado: a instância vive o processo inteiro e
+    um cliente assíncrono ficaria preso ao primeiro event loop; os retrievers
+    chamam embed_query em um executor mesmo nos caminhos assíncronos.
+    """
+    limits = httpx.Limits(max_keepalive_connections=EMBED_MAX_CONCURRENCY,
+                          max_connections=EMBED_MAX_CONCURRENCY * 2, keepalive_expiry=60)
+    timeout = httpx.Timeout(60.0, connect=5.0)
+    return CachedQueryEmbeddings(model=EMBED_MODEL, dimensions=EMBED_DIMENSIONS, chunk_size=EMBED_BATCH_SIZE,
+                                 max_retries=6, request_timeout=60,
+                                 http_client=httpx.Client(http2=True, limits=limits, timeout=timeout))
+
+
+def embed_in_batches(texts, batch_size=EMBED_BATCH_SIZE):
+    """
+    Gera os embeddings dos textos em lotes de `batch_size`, uma requisição por lote.
+
+    Os lotes são enviados em paralelo (até EMBED_MAX_CONCURRENCY requisições),
+    já que o tempo é dominado pela espera da API. Com EMBED_CACHE_ENABLED,
+    apenas os textos ainda não vistos são enviados.
+
+    Returns:
+        np.ndarray: matriz float32, uma linha por texto (precisão usada pelo Chroma)
+    """
+    embeddings = get_embeddings()
+
+    def embed(batch_texts):
+        batches = [batch_texts[start:start + batch_size] for start in range(0, len(batch_texts), batch_size)]
+        if len(batches) <= 1:
+            return embeddings.embed_documents(batch_texts) if batch_texts else []
+        vectors = []
+        with ThreadPoolExecutor(max_workers=min(EMBED_MAX_CONCURRENCY, len(batches))) as executor:
+            # map preserva a ordem dos lotes
+            for batch_vectors in executor.map(embeddings.embed_documents, batches):
+                vectors.extend(batch_vectors)
+        return vectors
+
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+
+    # Trechos repetidos (preâmbulos, "Revogado.", remissões) são embutidos uma única vez
+    positions = {}
+    order = [positions.setdefault(text, len(positions)) for text in texts]
+    unique_texts = list(positions)
+
+    if EMBED_CACHE_ENABLED:
+        vectors = get_or_compute(unique_texts, _EMBED_CACHE_MODEL, embed)
+    else:
+        vectors = np.asarray(embed(unique_texts), dtype=np.float32)
+    return vectors if len(unique_texts) == len(texts) else vectors[order]
+
+
+def chunk_id(text, metadata, position):
+    """ID determinístico do chunk: SHA-1 da fonte, do índice do chunk e do texto."""
+    metadata = metadata or {}
+    key = f"{metadata.get('source', '')}\0{metadata.get('chunk_index', position)}\0{text}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def add_texts_batched(vector_db, texts, metadatas, ids=None):
+    """
+    Adiciona textos ao banco vetorial com embeddings pré-calculados em lote.
+
+    Os IDs são determinísticos (chunk_id), então chunks já presentes na coleção
+    são ignorados antes do cálculo dos embeddings e reindexar um documento não
+    duplica vetores. Os vetores são gravados direto na coleção do Chroma,
+    respeitando o tamanho máximo de lote aceito pelo cliente.
+
+    Returns:
+        list: IDs dos chunks efetivamente adicionados
+    """
+    collection = vector_db._collection
+    max_batch = vector_db._client.get_max_batch_size()
+    if ids is None:
+        ids = [chunk_id(text, metadata, i) for i, (text, metadata) in enumerate(zip(texts, metadatas))]
+
+    # Descarta IDs já gravados e repetidos dentro do próprio lote
+    seen = set()
+    for start in range(0, len(ids), max_batch):
+        seen.update(collection.get(ids=ids[start:start + max_batch], include=[])["ids"])
+    keep = []
+    for i, id_ in enumerate(ids):
+        if id_ not in seen:
+            seen.add(id_)
+            keep.append(i)
+    if not keep:
+        return []
+
+    ids = [ids[i] for i in keep]
+    texts = [texts[i] for i in keep]
+    # O Chroma não aceita metadados vazios; usa None nesses casos
+    metadatas = [metadatas[i] or None for i in keep]
+    vectors = embed_in_batches(texts)
+    for start in range(0, len(texts), max_batch):
+        end = start + max_batch
+        collection.add(ids=ids[start:end], embeddings=vectors[start:end],
+                       documents=texts[start:end], metadatas=metadatas[start:end])
+    return ids
 
 
 def clear_vector_db():
@@ -22,63 +191,183 @@ def clear_vector_db():
         print("Não há banco de dados para limpar.")
 
 
+def _pdf_text_cache_path(pdf_path):
+    """Caminho do texto em cache para o PDF, identificado por tamanho, data de modificação, nome e flags de extração."""
+    stat = os.stat(pdf_path)
+    key = f"{stat.st_size}-{int(stat.st_mtime)}-f{_PDF_TEXT_FLAGS}-{os.path.basename(pdf_path)}"
+    return os.path.join(PDF_TEXT_CACHE_DIR, key + ".txt")
+
+
 def extract_text_from_pdf(pdf_path):
-    """Extrai texto do arquivo PDF com tratamento de erro robusto."""
+    """
+    Extrai texto do arquivo PDF com tratamento de erro robusto.
+
+    O texto extraído é guardado em disco (PDF_TEXT_CACHE_DIR); enquanto o
+    arquivo não mudar, as próximas chamadas apenas leem o cache.
+    """
     # Verificação do arquivo
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(f"Arquivo não encontrado: {pdf_path}")
-    
-    print(f"Abrindo arquivo: {pdf_path}")
+
+    cache_path = _pdf_text_cache_path(pdf_path)
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as cache_file:
+            return cache_file.read()
+
+    text = _read_pdf_text(pdf_path)
+    _write_pdf_text_cache(pdf_path, text)
+    return text
+
+
+def _write_pdf_text_cache(pdf_path, text):
+    """Grava o texto extraído no cache de forma atômica, para não deixar arquivos parciais."""
+    cache_path = _pdf_text_cache_path(pdf_path)
+    os.makedirs(PDF_TEXT_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=PDF_TEXT_CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
+            tmp_file.write(text)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"AVISO: Não foi possível gravar o cache de texto de {pdf_path}: {str(e)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _read_pdf_text(pdf_path):
+    """Lê o texto do PDF com PyMuPDF, usando o PyPDF2 como alternativa."""
+    if VERBOSE:
+        print(f"Abrindo arquivo: {pdf_path}")
     
     try:
-        # Abrir o PDF como um arquivo binário primeiro
-        with open(pdf_path, 'rb') as file_handle:
-            # Passar o conteúdo binário para o fitz
-            pdf_data = file_handle.read()
-            memory_stream = BytesIO(pdf_data)
-            doc = fitz.open(stream=memory_stream, filetype="pdf")
-            
-            text = ""
-            for page in doc:
-                text += page.get_text()
-            doc.close()
-            return text
+        # O PyMuPDF lê direto do caminho, sem carregar o arquivo inteiro em memória;
+        # o bloco with fecha o documento mesmo se a extração falhar
+        with fitz.open(pdf_path) as doc:
+            # Acumula as páginas em lista e junta uma única vez (evita cópias quadráticas)
+            parts = [page.get_text("text", flags=_PDF_TEXT_FLAGS) for page in doc]
+        return "".join(parts)
     except Exception as e:
         print(f"Erro ao processar o PDF {pdf_path}: {str(e)}")
+        if PyPDF2 is None:
+            raise
         # Tente um método alternativo
         try:
-            import PyPDF2
             with open(pdf_path, 'rb') as file:
                 reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page_num in range(len(reader.pages)):
-                    text += reader.pages[page_num].extract_text()
+                text = "".join(page.extract_text() or "" for page in reader.pages)
             return text
         except Exception as e2:
             print(f"Método alternativo também falhou: {str(e2)}")
             raise
 
+def _safe_extract(path):
+    """Extrai o texto do PDF devolvendo a exceção em vez de lançá-la (usado pelos processos filhos)."""
+    try:
+        return extract_text_from_pdf(path)
+    except Exception as e:
+        return e
+
+
+def _extract_task(task):
+    """
+    Executa uma tarefa de extração (usado pelos processos filhos).
+
+    A tarefa é (caminho, início, fim): sem faixa, extrai o arquivo inteiro
+    (com cache e alternativa PyPDF2); com faixa, apenas as páginas [início, fim).
+    """
+    path, start, end = task
+    if start is None:
+        return _safe_extract(path)
+    try:
+        with fitz.open(path) as doc:
+            return "".join(doc[i].get_text("text", flags=_PDF_TEXT_FLAGS) for i in range(start, end))
+    except Exception as e:
+        return e
+
+
+def _pdf_page_count(path):
+    """Número de páginas do PDF, ou 0 se o PyMuPDF não conseguir abri-lo."""
+    try:
+        with fitz.open(path) as doc:
+            return doc.page_count
+    except Exception:
+        return 0
+
+
+def extract_all_pdfs(paths, max_workers=None):
+    """
+    Extrai o texto de vários PDFs em paralelo.
+
+    O PyMuPDF não pode ser usado por várias threads ao mesmo tempo, então a
+    extração roda em processos separados (até `max_workers`, padrão: número de
+    CPUs). PDFs com PDF_PARALLEL_MIN_PAGES páginas ou mais são divididos em
+    faixas de páginas, para que um único documento grande também use todos os
+    processos. PDFs que já estão no cache de texto são lidos direto, sem processo.
+
+    Returns:
+        dict: caminho -> texto extraído, ou a exceção levantada para aquele arquivo
+    """
+    paths = list(paths)
+    results = {}
+    pending = []
+    for path in paths:
+        if os.path.exists(path) and os.path.exists(_pdf_text_cache_path(path)):
+            results[path] = _safe_extract(path)
+        else:
+            pending.append(path)
+
+    workers = max_workers or os.cpu_count() or 1
+    tasks = []
+    for path in pending:
+        page_count = _pdf_page_count(path) if workers > 1 and os.path.exists(path) else 0
+        if page_count >= PDF_PARALLEL_MIN_PAGES:
+            step = -(-page_count // workers)
+            tasks.extend((path, start, min(start + step, page_count)) for start in range(0, page_count, step))
+        else:
+            tasks.append((path, None, None))
+
+    if len(tasks) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+                outputs = list(executor.map(_extract_task, tasks))
+            # Junta as faixas de cada PDF na ordem das páginas (map preserva a ordem)
+            parts = {}
+            for (path, start, _), output in zip(tasks, outputs):
+                if start is None:
+                    results[path] = output
+                else:
+                    parts.setdefault(path, []).append(output)
+            for path, texts in parts.items():
+                if any(isinstance(text, Exception) for text in texts):
+                    # Refaz o arquivo inteiro, que tenta também o método alternativo
+                    results[path] = _safe_extract(path)
+                else:
+                    results[path] = "".join(texts)
+                    _write_pdf_text_cache(path, results[path])
+            pending = []
+        except BrokenProcessPool as e:
+            print(f"AVISO: Extração paralela interrompida ({str(e)}). Extraindo sequencialmente...")
+    for path in pending:
+        results[path] = _safe_extract(path)
+
+    return {path: results[path] for path in paths}
+
+
 def clean_text(text):
     """Limpa o texto removendo espaços extras, caracteres especiais, etc."""
     # Substitui múltiplos espaços em branco por um único espaço
-    text = re.sub(r'\s+', ' ', text)
+    text = _WS_RE.sub(' ', text)
     # Remove caracteres de controle e outros não imprimíveis
-    text = re.sub(r'[\x00-\x1F\x7F-\x9F]', '', text)
+    text = _CTRL_RE.sub('', text)
     return text.strip()
 
 
 def split_text(text, doc_info=None):
     """Divide o texto em chunks para processamento."""
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        length_function=len,
-        separators=["\n\n", "\n", ". ", " ", ""]
-    )
-    
     # Isso retorna uma lista de strings
-    raw_chunks = text_splitter.split_text(text)
-    print(f"Texto dividido em {len(raw_chunks)} raw_chunks (strings)")
+    raw_chunks = _DEFAULT_SPLITTER.split_text(text)
+    if VERBOSE:
+        print(f"Texto dividido em {len(raw_chunks)} raw_chunks (strings)")
     
     # Convertemos para o formato esperado com metadados
     chunks = []
@@ -103,13 +392,11 @@ def split_text(text, doc_info=None):
         
         chunks.append(chunk)
     
-    # Verificação final
-    print(f"Convertido para {len(chunks)} chunks (dicionários)")
-    
-
-    print(f"DEBUGGING split_text: Retornando {len(chunks)} chunks")
-    for i in range(min(3, len(chunks))):
-        print(f"DEBUGGING split_text: Chunk {i} é do tipo {type(chunks[i])}")
+    # Verificação final (apenas no modo detalhado)
+    if VERBOSE:
+        print(f"Convertido para {len(chunks)} chunks (dicionários)")
+        for i in range(min(3, len(chunks))):
+            print(f"DEBUGGING split_text: Chunk {i} é do tipo {type(chunks[i])}")
 
     return chunks
 
@@ -117,16 +404,15 @@ def split_text(text, doc_info=None):
 def create_vector_db(chunks):
     """Gera embeddings e armazena no Chroma DB."""
     # Inicializa o modelo de embeddings
-    embeddings = OpenAIEmbeddings(model=EMBED_MODEL)
+    embeddings = get_embeddings()
     
     # Processa chunks para extrair textos e metadados de forma segura
     texts = []
     metadatas = []
-    
     for chunk in chunks:
         if isinstance(chunk, dict) and "text" in chunk and "metadata" in chunk:
             texts.append(chunk["text"])
-            metadatas.append(filter_complex_metadata(chunk["metadata"]))
+            metadatas.append(_fast_filter_metadata(chunk["metadata"]))
         elif isinstance(chunk, str):
             texts.append(chunk)
             metadatas.append({})
@@ -134,32 +420,38 @@ def create_vector_db(chunks):
             print(f"AVISO: Tipo de chunk inesperado: {type(chunk)}")
             continue
     
-    # Cria o banco de dados Chroma
-    db = Chroma.from_texts(
-        texts=texts,
-        embedding=embeddings,
-        metadatas=metadatas,
-        persist_directory=DB_PATH
+    # Cria o banco de dados Chroma e adiciona os embeddings calculados em lote
+    db = Chroma(
+        persist_directory=DB_PATH,
+        embedding_function=embeddings,
+        collection_metadata=CHROMA_COLLECTION_METADATA
     )
+    add_texts_batched(db, texts, metadatas)
     
     return db
 
 
 def load_vector_db():
     """Carrega o banco de dados vetorial existente."""
-    embeddings = OpenAIEmbeddings(
-        model=EMBED_MODEL
-        # Removido o parâmetro dimensions que não é mais suportado
-    )
+    embeddings = get_embeddings()
     db = Chroma(
         persist_directory=DB_PATH,
-        embedding_function=embeddings
+        embedding_function=embeddings,
+        collection_metadata=CHROMA_COLLECTION_METADATA
     )
     return db
 
+def _db_has_contents(path=DB_PATH):
+    """Indica se o diretório do banco existe e não está vazio, lendo no máximo uma entrada."""
+    try:
+        with os.scandir(path) as entries:
+            return next(entries, None) is not None
+    except (FileNotFoundError, NotADirectoryError):
+        return False
+
 def get_or_create_db():
     """Verifica se o banco de dados existe e carrega-o ou cria-o se necessário."""
-    if os.path.exists(DB_PATH) and len(os.listdir(DB_PATH)) > 0:
+    if _db_has_contents():
         print(f"Carregando banco de dados vetorial existente de '{DB_PATH}'...")
         return load_vector_db()
     else:
@@ -171,65 +463,32 @@ def extract_article_metadata(text):
     metadata = {}
 
     #Padrões para identificar elementos estruturais
-    article_match = re.search(r'Art\.\s*(d+)', text)
-    chapter_match = re.search(r'CAPÍTULO\s+([IVX]+[0-9]+)', text, re.IGNORECASE)
-    title_match   = re.search(r'TÍTULO\s+(IVX]+|[0-9]+)', text, re.IGNORECASE)
+    article_match = _ART_NUM_RE.search(text)
+    chapter_match = _CHAPTER_RE.search(text)
+    title_match   = _TITLE_RE.search(text)
 
     if article_match:
         metadata['article'] = article_match.group(1)
     if chapter_match:
         metadata['chapter'] = chapter_match.group(1)
     if title_match:
-        metadata['title'] = article_match.group(1)
+        metadata['title'] = title_match.group(1)
     
     return metadata
 
-def split_text_by_articles(text):
-    """Divide o texto em chunks baseados na estrutura de artigos do CDC."""
-    # Regex para identificar padrões de artigos no CDC
-    article_pattern = r'Art\.\s*(\d+)\.?\s*(.?)(?=Art\.\s\d+\.?|$)'
-    
-    # Encontra todos os artigos
-    articles = re.findall(article_pattern, text, re.DOTALL)
-    chunks = []
-    
-    for number, content in articles:
-        # Limpa o conteúdo
-        clean_content = clean_text(content)
-        
-        # Cria um chunk com metadados
-        chunk = {
-            "text": f"Artigo {number}: {clean_content}",
-            "metadata": {
-                "source": "CDC",
-                "article_number": number,
-                "content_type": "article"
-            }
-        }
-        chunks.append(chunk)
-        
-        # Se o artigo for muito grande, divide em sub-chunks
-        if len(clean_content) > CHUNK_SIZE:
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=CHUNK_SIZE,
-                chunk_overlap=CHUNK_OVERLAP
-            )
-            sub_chunks = text_splitter.split_text(clean_content)
-            
-            # Adiciona cada sub-chunk com metadados preservados
-            for i, sub_chunk in enumerate(sub_chunks):
-                sub_chunk_dict = {
-                    "text": f"Artigo {number} (parte {i+1}): {sub_chunk}",
-                    "metadata": {
-                        "source": "CDC",
-                        "article_number": number,
-                        "content_type": "article_part",
-                        "part_number": i+1
-                    }
-                }
-                chunks.append(sub_chunk_dict)
-    
-    return chunks
+def _find_articles(header_re, text):
+    """
+    Retorna (número, conteúdo) de cada artigo em uma única varredura linear.
+
+    Localiza os cabeçalhos com finditer e fatia o texto entre cabeçalhos
+    consecutivos, sem lookahead nem retrocesso sobre o restante do documento.
+    """
+    matches = list(header_re.finditer(text))
+    articles = []
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        articles.append((match.group(1), text[match.end():end]))
+    return articles
 
 
 def update_vector_db(document_paths, vector_db=None, document_metadata=None):
@@ -241,10 +500,10 @@ def update_vector_db(document_paths, vector_db=None, document_metadata=None):
     
     if not hasattr(vector_db, 'add_texts'):
         print("Criando um novo banco de dados vetorial...")
-        embeddings = OpenAIEmbeddings(model=EMBED_MODEL)
         vector_db = Chroma(
             persist_directory=DB_PATH,
-            embedding_function=embeddings
+            embedding_function=get_embeddings(),
+            collection_metadata=CHROMA_COLLECTION_METADATA
         )
     
     if document_metadata is None:
@@ -252,6 +511,35 @@ def update_vector_db(document_paths, vector_db=None, document_metadata=None):
     
     total_chunks = 0
     
+    # Chunks de vários documentos são acumulados e gravados juntos a cada
+    # EMBED_BATCH_SIZE: documentos pequenos compartilham a mesma requisição de
+    # embeddings e a mesma transação no Chroma, e a memória continua limitada
+    pending_ids, pending_texts, pending_metadatas = [], [], []
+    pending_docs = {}  # Documentos com chunks no buffer (dict mantém a ordem)
+    
+    def flush_pending():
+        """Grava o buffer e retorna quantos chunks foram de fato adicionados."""
+        if not pending_texts:
+            return 0
+        added_count = 0
+        try:
+            added = add_texts_batched(vector_db, pending_texts, pending_metadatas, ids=pending_ids)
+            added_count = len(added)
+            print(f"  -> {added_count} chunks adicionados ao banco de dados com sucesso "
+                  f"({len(pending_texts) - added_count} já existentes).")
+        except Exception as e:
+            print(f"Erro ao gravar {len(pending_texts)} chunks no banco de dados "
+                  f"(documentos: {', '.join(pending_docs)}): {str(e)}")
+        pending_ids.clear()
+        pending_texts.clear()
+        pending_metadatas.clear()
+        pending_docs.clear()
+        return added_count
+    
+    # Extrai o texto de todos os PDFs em paralelo antes de processar os documentos
+    raw_texts = extract_all_pdfs(p for p in document_paths.values()
+                                 if p.lower().endswith('.pdf') and os.path.exists(p))
+    
     for doc_name, doc_path in document_paths.items():
         if not os.path.exists(doc_path):
             print(f"AVISO: Arquivo não encontrado: {doc_path}. Pulando...")
@@ -262,7 +550,9 @@ def update_vector_db(document_paths, vector_db=None, document_metadata=None):
         try:
             # Extrai e processa o texto
             if doc_path.lower().endswith('.pdf'):
-                raw_text = extract_text_from_pdf(doc_path)
+                raw_text = raw_texts[doc_path]
+                if isinstance(raw_text, Exception):
+                    raise raw_text
             elif doc_path.lower().endswith(('.txt', '.md')):
                 with open(doc_path, 'r', encoding='utf-8') as file:
                     raw_text = file.read()
@@ -280,33 +570,22 @@ def update_vector_db(document_paths, vector_db=None, document_metadata=None):
             if doc_name in document_metadata:
                 doc_info.update(document_metadata[doc_name])
             
-            # Divide o texto em chunks
-            chunks = split_legal_text(cleaned_text, doc_info)
+            # Divide o texto em chunks e os envia ao buffer à medida que são gerados,
+            # sem montar a lista do documento inteiro
+            doc_chunks = 0
+            for chunk in iter_legal_chunks(cleaned_text, doc_info):
+                metadata = _fast_filter_metadata(chunk["metadata"])
+                # Os IDs usam a posição dentro do documento, independente do lote
+                pending_ids.append(chunk_id(chunk["text"], metadata, doc_chunks))
+                pending_texts.append(chunk["text"])
+                pending_metadatas.append(metadata)
+                pending_docs[doc_name] = None
+                doc_chunks += 1
+                if len(pending_texts) >= EMBED_BATCH_SIZE:
+                    total_chunks += flush_pending()
             
-            print(f"  -> Documento dividido em {len(chunks)} chunks.")
-            total_chunks += len(chunks)
-            
-            # ABORDAGEM SIMPLIFICADA: Processa chunks diretamente
-            texts = []
-            metadatas = []
-            
-            # Coleta todos os textos e metadados primeiro
-            for chunk in chunks:
-                # Usamos apenas os chunks que são dicionários com formato correto
-                if isinstance(chunk, dict) and "text" in chunk and "metadata" in chunk:
-                    text = chunk["text"]
-                    metadata = chunk["metadata"]
-                    
-                    # Verifica se metadata é um dicionário
-                    if isinstance(metadata, dict):
-                        texts.append(text)
-                        metadatas.append(filter_complex_metadata(metadata))
-            
-            # Verifica se temos dados para adicionar
-            if texts and metadatas:
-                # Adiciona todos de uma vez
-                vector_db.add_texts(texts=texts, metadatas=metadatas)
-                print(f"  -> {len(texts)} chunks adicionados ao banco de dados com sucesso.")
+            if doc_chunks:
+                print(f"  -> Documento dividido em {doc_chunks} chunks.")
             else:
                 print("  -> Nenhum chunk válido para adicionar ao banco de dados.")
                 
@@ -314,18 +593,14 @@ def update_vector_db(document_paths, vector_db=None, document_metadata=None):
             print(f"Erro ao processar documento {doc_name}: {str(e)}")
             print(f"Continuando com os próximos documentos...")
     
+    total_chunks += flush_pending()
     print(f"Banco de dados atualizado com sucesso. Total de {total_chunks} novos chunks adicionados.")
     return vector_db
 
 
 def month_to_number(month_name):
     """Converte nome do mês para número."""
-    months = {
-        'janeiro': '01', 'fevereiro': '02', 'março': '03', 'abril': '04',
-        'maio': '05', 'junho': '06', 'julho': '07', 'agosto': '08',
-        'setembro': '09', 'outubro': '10', 'novembro': '11', 'dezembro': '12'
-    }
-    return months.get(month_name.lower(), '00')
+    return _MONTHS.get(month_name.lower(), '00')
 
 
 
@@ -346,129 +621,117 @@ def extract_document_info(doc_name, text):
     }
     
     # Identifica o tipo de documento
-    if "lei" in doc_name.lower():
+    name = doc_name.lower()
+    if "lei" in name:
         info["doc_type"] = "lei"
-    elif "decreto" in doc_name.lower():
+    elif "decreto" in name:
         info["doc_type"] = "decreto"
-    elif "resolução" in doc_name.lower() or "resolucao" in doc_name.lower():
+    elif "resolução" in name or "resolucao" in name:
         info["doc_type"] = "resolucao"
-    elif "código" in doc_name.lower() or "codigo" in doc_name.lower():
+    elif "código" in name or "codigo" in name:
         info["doc_type"] = "codigo"
     
     # Extrai número do documento
-    number_match = re.search(r'(?:n[º°.]?\s*)([\d\.]+)(?:/(\d{4}))?', doc_name)
+    number_match = _DOC_NUMBER_RE.search(doc_name)
     if number_match:
         info["doc_number"] = number_match.group(1)
         if number_match.group(2):  # Ano
             info["doc_year"] = number_match.group(2)
     
-    # Tenta extrair a data de promulgação do texto
-    date_match = re.search(r'(\d{1,2})\s+de\s+([a-zç]+)\s+de\s+(\d{4})', text, re.IGNORECASE)
+    # Tenta extrair a data de promulgação do cabeçalho do texto
+    date_match = _DATE_RE.search(text, 0, _META_SCAN_CHARS)
     if date_match:
         info["publication_date"] = f"{date_match.group(1)}/{month_to_number(date_match.group(2))}/{date_match.group(3)}"
     
     return info
 
 
-def split_legal_text(text, doc_info):
+def iter_legal_chunks(text, doc_info):
     """
-    Divide o texto legal em chunks baseados na estrutura de artigos/seções.
+    Gera os chunks do texto legal um a um, com base na estrutura de artigos/seções.
+    
+    Produz os mesmos chunks de split_legal_text, mas sem montar a lista do
+    documento inteiro: quem consome pode gravá-los em lotes à medida que surgem.
     
     Args:
-        text (str): Texto limpo do documento
+        text (str): Texto do documento já limpo por clean_text (não é limpo de novo por artigo)
         doc_info (dict): Informações estruturais do documento
     
-    Returns:
-        list: Lista de chunks com metadados
+    Yields:
+        dict: Chunk com "text" e "metadata"
     """
-    chunks = []
+    # Metadados comuns do documento; cada chunk recebe uma cópia com seus próprios campos
+    base_metadata = doc_info if isinstance(doc_info, dict) else {"source": "document"}
     
-    # Padrões para documentos jurídicos brasileiros
-    article_pattern = r'Art\.?\s*(\d+[º°]?[A-Z]?)[.\s-]+(.*?)(?=Art\.?\s*\d+[º°]?[A-Z]?|$)'
-    
-    # Tenta dividir por artigos
-    articles = re.findall(article_pattern, text, re.DOTALL)
+    # Tenta dividir por artigos (padrão para documentos jurídicos brasileiros em _ARTICLE_HEADER_RE)
+    articles = _find_articles(_ARTICLE_HEADER_RE, text)
     
     if articles:
         for number, content in articles:
-            # Limpa o conteúdo
-            clean_content = clean_text(content)
+            number = number.strip()
+            # O texto já foi limpo; basta remover os espaços das bordas do artigo
+            clean_content = content.strip()
             
-            # Cria metadados específicos para este chunk
-            metadata = doc_info.copy() if isinstance(doc_info, dict) else {"source": "document"}
-            metadata["article_number"] = number.strip()
-            metadata["content_type"] = "article"
+            # Cria metadados específicos para este chunk (um único literal, sem copiar e alterar)
+            metadata = {**base_metadata, "article_number": number, "content_type": "article"}
             
             # Cria o chunk com referência explícita ao artigo
-            chunk_text = f"Artigo {number.strip()}: {clean_content}"
+            chunk_text = f"Artigo {number}: {clean_content}"
             
             # Se o artigo for muito grande, subdivide
             if len(chunk_text) > CHUNK_SIZE:
-                text_splitter = RecursiveCharacterTextSplitter(
-                    chunk_size=CHUNK_SIZE,
-                    chunk_overlap=CHUNK_OVERLAP
-                )
-                sub_chunks = text_splitter.split_text(chunk_text)
+                sub_chunks = _DEFAULT_SPLITTER.split_text(chunk_text)
+                total_parts = len(sub_chunks)
                 
                 for i, sub_chunk in enumerate(sub_chunks):
-                    sub_metadata = metadata.copy()
-                    sub_metadata["part"] = i + 1
-                    sub_metadata["total_parts"] = len(sub_chunks)
-                    
-                    # Adiciona como dicionário com text e metadata
-                    chunks.append({
+                    yield {
                         "text": sub_chunk,
-                        "metadata": sub_metadata
-                    })
+                        "metadata": {**metadata, "part": i + 1, "total_parts": total_parts}
+                    }
             else:
                 # Artigo não é grande, manter como um único chunk
-                chunks.append({
+                yield {
                     "text": chunk_text,
                     "metadata": metadata
-                })
+                }
     else:
         # Se não encontrou estrutura de artigos, usa chunking padrão
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP
-        )
-        simple_chunks = text_splitter.split_text(text)
+        simple_chunks = _DEFAULT_SPLITTER.split_text(text)
+        total_chunks = len(simple_chunks)
         
         for i, chunk in enumerate(simple_chunks):
-            metadata = doc_info.copy() if isinstance(doc_info, dict) else {"source": "document"}
-            metadata["chunk_index"] = i
-            metadata["total_chunks"] = len(simple_chunks)
-            
-            # Adiciona como dicionário com text e metadata
-            chunks.append({
+            yield {
                 "text": chunk,
-                "metadata": metadata
-            })
+                "metadata": {**base_metadata, "chunk_index": i, "total_chunks": total_chunks}
+            }
+
+
+def split_legal_text(text, doc_info):
+    """
+    Divide o texto legal em chunks baseados na estrutura de artigos/seções.
     
-    # Verificação de segurança adicional
-    validated_chunks = []
-    for chunk in chunks:
-        if isinstance(chunk, dict) and "text" in chunk and "metadata" in chunk:
-            validated_chunks.append(chunk)
-        elif isinstance(chunk, str):
-            # Se por algum motivo ainda tivermos strings, convertemos para o formato correto
-            validated_chunks.append({
-                "text": chunk,
-                "metadata": {"source": "document"}
-            })
+    Args:
+        text (str): Texto do documento já limpo por clean_text (não é limpo de novo por artigo)
+        doc_info (dict): Informações estruturais do documento
+    
+    Returns:
+        list: Lista de chunks com metadados (ver iter_legal_chunks)
+    """
+    chunks = list(iter_legal_chunks(text, doc_info))
     
-    print(f"DEBUGGING split_legal_text: Retornando {len(chunks)} chunks")
-    for i in range(min(3, len(chunks))):
-        print(f"DEBUGGING split_legal_text: Chunk {i} é do tipo {type(chunks[i])}")
+    if VERBOSE:
+        print(f"DEBUGGING split_legal_text: Retornando {len(chunks)} chunks")
+        for i in range(min(3, len(chunks))):
+            print(f"DEBUGGING split_legal_text: Chunk {i} é do tipo {type(chunks[i])}")
 
-    return validated_chunks
+    return chunks
 
 
 def integrate_consumer_law_documents():
     """Integra documentos de legislação do consumidor com verificação de duplicatas."""
     # Carrega ou cria o banco de dados
     vector_db = None
-    if os.path.exists(DB_PATH) and len(os.listdir(DB_PATH)) > 0:
+    if _db_has_contents():
         print(f"Carregando banco de dados vetorial existente de '{DB_PATH}'...")
         vector_db = load_vector_db()
         
@@ -487,7 +750,7 @@ def integrate_consumer_law_documents():
                 
             # Filtra apenas os documentos que ainda não foram processados
             docs_to_process = {}
-            for doc_name, doc_path in DOCUMENTO_PATHS.items():
+            for doc_name, doc_path in get_documento_paths().items():
                 if doc_name not in existing_sources and os.path.exists(doc_path) and os.path.getsize(doc_path) > 0:
                     docs_to_process[doc_name] = doc_path
             
@@ -495,10 +758,12 @@ def integrate_consumer_law_documents():
             for doc_name in docs_to_process:
                 print(f"  - {doc_name}")
                 
-            # Processa apenas os novos documentos
+            # Processa apenas os novos documentos, extraindo os PDFs em paralelo
+            raw_texts = extract_all_pdfs(docs_to_process.values())
             for doc_name, doc_path in docs_to_process.items():
                 print(f"Processando documento: {doc_name} ({doc_path})")
-                vector_db = process_and_add_document(doc_name, doc_path, vector_db=vector_db)
+                vector_db = process_and_add_document(doc_name, doc_path, vector_db=vector_db,
+                                                     raw_text=raw_texts.get(doc_path))
                 
             return vector_db
             
@@ -509,14 +774,13 @@ def integrate_consumer_law_documents():
     # Se não há banco de dados ou ocorreu erro na verificação,
     # processa todos os documentos disponíveis
     print("Processando todos os documentos disponíveis...")
-    for doc_name, doc_path in DOCUMENTO_PATHS.items():
-        if os.path.exists(doc_path) and os.path.getsize(doc_path) > 0:
-            print(f"Processando documento: {doc_name} ({doc_path})")
-            vector_db = process_and_add_document(doc_name, doc_path, vector_db=vector_db)
-    
-    return vector_db
-    
-    # Adicione outros documentos conforme necessário
+    available_docs = {doc_name: doc_path for doc_name, doc_path in get_documento_paths().items()
+                      if os.path.exists(doc_path) and os.path.getsize(doc_path) > 0}
+    raw_texts = extract_all_pdfs(available_docs.values())
+    for doc_name, doc_path in available_docs.items():
+        print(f"Processando documento: {doc_name} ({doc_path})")
+        vector_db = process_and_add_document(doc_name, doc_path, vector_db=vector_db,
+                                             raw_text=raw_texts.get(doc_path))
     
     return vector_db
 
@@ -573,31 +837,86 @@ def configure_advanced_retriever(db):
     return advanced_retriever
 
 
-def process_and_add_document(doc_name, doc_path, vector_db=None, custom_metadata=None):
+class FastMMRRetriever(BaseRetriever):
+    """
+    Retriever MMR (Maximal Marginal Relevance) sobre uma coleção Chroma.
+
+    Produz a mesma seleção que db.as_retriever(search_type="mmr"), mas calcula
+    a matriz de similaridade entre os candidatos uma única vez (uma multiplicação
+    de matrizes) e mantém, a cada passo, a maior similaridade de cada candidato
+    com os já selecionados, em vez de recalcular produtos escalares no laço.
+    """
+
+    vectorstore: Chroma
+    k: int = 4
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        query_vec = np.asarray(self.vectorstore.embeddings.embed_query(query), dtype=np.float32)
+        results = self.vectorstore._collection.query(
+            query_embeddings=[query_vec.tolist()],
+            n_results=self.fetch_k,
+            include=["documents", "metadatas", "embeddings"]
+        )
+        texts = results["documents"][0]
+        if not texts:
+            return []
+        metadatas = results["metadatas"][0]
+
+        # Normaliza os vetores para que o produto escalar seja a similaridade de cosseno
+        pool = np.asarray(results["embeddings"][0], dtype=np.float32)
+        pool /= np.maximum(np.linalg.norm(pool, axis=1, keepdims=True), 1e-12)
+        query_vec /= max(np.linalg.norm(query_vec), 1e-12)
+
+        query_sim = pool @ query_vec
+        pool_sim = pool @ pool.T
+
+        selected = [int(np.argmax(query_sim))]
+        max_sim_to_selected = pool_sim[:, selected[0]].copy()
+        available = np.ones(len(texts), dtype=bool)
+        available[selected[0]] = False
+
+        while len(selected) < min(self.k, len(texts)):
+            scores = self.lambda_mult * query_sim - (1 - self.lambda_mult) * max_sim_to_selected
+            scores[~available] = -np.inf
+            best = int(np.argmax(scores))
+            selected.append(best)
+            available[best] = False
+            np.maximum(max_sim_to_selected, pool_sim[:, best], out=max_sim_to_selected)
+
+        # Mantém a ordem original de relevância, como faz a busca MMR do Chroma
+        return [Document(page_content=texts[i], metadata=metadatas[i] or {}) for i in sorted(selected)]
+
+
+def process_and_add_document(doc_name, doc_path, vector_db=None, custom_metadata=None, raw_text=None):
     """
     Processa um único documento e o adiciona ao banco de dados - abordagem simples e direta.
+
+    Se `raw_text` for informado (ex.: extraído previamente por extract_all_pdfs),
+    o PDF não é lido novamente. Uma exceção em `raw_text` é relançada.
     """
     print(f"Processando documento: {doc_name} ({doc_path})")
     
     # Obtém ou cria o banco de dados
     if vector_db is None:
-        vector_db = load_vector_db() if os.path.exists(DB_PATH) and len(os.listdir(DB_PATH)) > 0 else None
+        vector_db = load_vector_db() if _db_has_contents() else None
     
     if vector_db is None or not hasattr(vector_db, 'add_texts'):
-        embeddings = OpenAIEmbeddings(model=EMBED_MODEL)
-        vector_db = Chroma(persist_directory=DB_PATH, embedding_function=embeddings)
+        vector_db = Chroma(persist_directory=DB_PATH, embedding_function=get_embeddings(),
+                           collection_metadata=CHROMA_COLLECTION_METADATA)
     
     # Extrai e limpa o texto
-    raw_text = extract_text_from_pdf(doc_path)
+    if raw_text is None:
+        raw_text = extract_text_from_pdf(doc_path)
+    elif isinstance(raw_text, Exception):
+        raise raw_text
     cleaned_text = clean_text(raw_text)
     
     # Divide o texto em partes menores
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        separators=["\n\n", "\n", ". ", " ", ""]
-    )
-    chunks = text_splitter.split_text(cleaned_text)
+    chunks = _DEFAULT_SPLITTER.split_text(cleaned_text)
     print(f"Documento dividido em {len(chunks)} chunks")
     
     # Prepara metadados base
@@ -633,8 +952,8 @@ def process_and_add_document(doc_name, doc_path, vector_db=None, custom_metadata
     
     # Adiciona ao banco de dados
     if texts and metadatas:
-        vector_db.add_texts(texts=texts, metadatas=metadatas)
-        print(f"Adicionados {len(texts)} chunks ao banco de dados")
+        added = add_texts_batched(vector_db, texts, metadatas)
+        print(f"Adicionados {len(added)} chunks ao banco de dados ({len(texts) - len(added)} já existentes)")
     
     return vector_db
 
@@ -643,29 +962,43 @@ def process_all_documents():
     """Processa todos os documentos e os adiciona ao banco de dados."""
     print("Iniciando processamento de todos os documentos...")
     
-    # Inicializa modelo de embeddings
-    embeddings = OpenAIEmbeddings(model=EMBED_MODEL)
+    # Cria o banco de dados; os chunks são adicionados documento a documento,
+    # sem acumular o corpus inteiro (e seus embeddings) em memória
+    db = Chroma(
+        persist_directory=DB_PATH,
+        embedding_function=get_embeddings(),
+        collection_metadata=CHROMA_COLLECTION_METADATA
+    )
+    total_chunks = 0
     
-    # Lista para armazenar todos os chunks com metadados
-    all_texts = []
-    all_metadatas = []
+    # Trechos idênticos entre documentos (preâmbulos, remissões, artigos citados)
+    # são gravados uma única vez; as demais fontes ficam em "also_in" da primeira cópia
+    first_copies = {}   # hash do texto -> (id, metadados) da primeira cópia
+    also_in = {}        # id da primeira cópia -> outras fontes com o mesmo texto
     
+    # Extrai o texto de todos os PDFs existentes em paralelo
+    raw_texts = extract_all_pdfs(p for p in get_documento_paths().values() if os.path.exists(p))
+
     # Processa cada documento
-    for doc_name, doc_path in DOCUMENTO_PATHS.items():
+    for doc_name, doc_path in get_documento_paths().items():
         print(f"\nProcessando documento: {doc_name}")
         try:
             if os.path.exists(doc_path):
-                # Extrai e processa o texto
-                raw_text = extract_text_from_pdf(doc_path)
+                # Obtém o texto extraído e processa
+                raw_text = raw_texts[doc_path]
+                if isinstance(raw_text, Exception):
+                    raise raw_text
                 cleaned_text = clean_text(raw_text)
                 
                 # Informações de debug
-                print(f"Texto extraído do PDF: {len(raw_text)} caracteres")
-                print(f"Texto limpo: {len(cleaned_text)} caracteres")
+                if VERBOSE:
+                    print(f"Texto extraído do PDF: {len(raw_text)} caracteres")
+                    print(f"Texto limpo: {len(cleaned_text)} caracteres")
                 
                 # Cria informações sobre o documento
                 doc_info = extract_document_info(doc_name, cleaned_text)
-                print(f"Metadados do documento: {doc_info}")
+                if VERBOSE:
+                    print(f"Metadados do documento: {doc_info}")
                 
                 # Divide o texto em chunks - AQUI ESTÁ O PROBLEMA POTENCIAL
                 # Pode estar retornando strings em vez de dicionários
@@ -673,28 +1006,62 @@ def process_all_documents():
                 print(f"Documento dividido em {len(chunks)} chunks.")
                 
                 # Verifica o tipo de cada chunk para debug
-                for i, chunk in enumerate(chunks[:2]):  # Mostra apenas os 2 primeiros para não sobrecarregar o log
-                    print(f"Chunk {i} tipo: {type(chunk)}")
-                    if isinstance(chunk, dict):
-                        print(f"Chunk {i} keys: {chunk.keys()}")
-                    else:
-                        print(f"Chunk {i} não é um dicionário, é {type(chunk)}")
+                if VERBOSE:
+                    for i, chunk in enumerate(chunks[:2]):  # Mostra apenas os 2 primeiros para não sobrecarregar o log
+                        print(f"Chunk {i} tipo: {type(chunk)}")
+                        if isinstance(chunk, dict):
+                            print(f"Chunk {i} keys: {chunk.keys()}")
+                        else:
+                            print(f"Chunk {i} não é um dicionário, é {type(chunk)}")
                 
                 # Processa os chunks com segurança
+                texts = []
+                metadatas = []
                 for chunk in chunks:
                     if isinstance(chunk, dict) and "text" in chunk and "metadata" in chunk:
                         # Se for um dicionário com a estrutura esperada
-                        all_texts.append(chunk["text"])
-                        all_metadatas.append(filter_complex_metadata(chunk["metadata"]))
+                        texts.append(chunk["text"])
+                        metadatas.append(_fast_filter_metadata(chunk["metadata"]))
                     elif isinstance(chunk, str):
                         # Se for uma string
-                        all_texts.append(chunk)
-                        all_metadatas.append({"source": doc_name})
+                        texts.append(chunk)
+                        metadatas.append({"source": doc_name})
                     else:
                         # Tipo inesperado, trata como uma string vazia
                         print(f"AVISO: Chunk de tipo inesperado: {type(chunk)}")
-                        all_texts.append("")
-                        all_metadatas.append({"source": doc_name, "error": "tipo_inesperado"})
+                        texts.append("")
+                        metadatas.append({"source": doc_name, "error": "tipo_inesperado"})
+                
+                # Remove os trechos já vistos neste documento ou já gravados a partir de outro
+                unique_ids, unique_texts, unique_metadatas, unique_hashes = [], [], [], []
+                seen_in_doc = set()
+                for i, (text, metadata) in enumerate(zip(texts, metadatas)):
+                    text_hash = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+                    first = first_copies.get(text_hash)
+                    if first is None:
+                        if text_hash not in seen_in_doc:
+                            seen_in_doc.add(text_hash)
+                            unique_ids.append(chunk_id(text, metadata, i))
+                            unique_texts.append(text)
+                            unique_metadatas.append(metadata)
+                            unique_hashes.append(text_hash)
+                    elif metadata.get("source") != first[1].get("source"):
+                        sources = also_in.setdefault(first[0], [])
+                        if metadata.get("source") not in sources:
+                            sources.append(metadata.get("source"))
+                if len(unique_texts) < len(texts):
+                    print(f"{len(texts) - len(unique_texts)} chunks repetidos ignorados.")
+                
+                # Grava os chunks do documento em lotes de EMBED_BATCH_SIZE; só depois de
+                # gravado um trecho passa a valer como primeira cópia para os seguintes
+                for start in range(0, len(unique_texts), EMBED_BATCH_SIZE):
+                    end = start + EMBED_BATCH_SIZE
+                    added = add_texts_batched(db, unique_texts[start:end], unique_metadatas[start:end],
+                                              ids=unique_ids[start:end])
+                    total_chunks += len(added)
+                    for text_hash, id_, metadata in zip(unique_hashes[start:end], unique_ids[start:end],
+                                                        unique_metadatas[start:end]):
+                        first_copies[text_hash] = (id_, metadata)
             else:
                 print(f"AVISO: Arquivo não encontrado: {doc_path}")
         except Exception as e:
@@ -703,17 +1070,18 @@ def process_all_documents():
             traceback.print_exc()
             print(f"Continuando com os próximos documentos...")
     
-    # Cria o banco de dados com todos os textos coletados
-    print(f"\nCriando banco de dados com {len(all_texts)} chunks no total...")
-    
-    db = Chroma.from_texts(
-        texts=all_texts,
-        embedding=embeddings,
-        metadatas=all_metadatas,
-        persist_directory=DB_PATH
-    )
+    # Registra nas primeiras cópias as demais fontes que contêm o mesmo trecho
+    if also_in:
+        metadata_by_id = {id_: metadata for id_, metadata in first_copies.values()}
+        existing = set(db._collection.get(ids=list(also_in), include=[])["ids"])
+        ids = [id_ for id_ in also_in if id_ in existing]
+        if ids:
+            db._collection.update(
+                ids=ids,
+                metadatas=[{**metadata_by_id[id_], "also_in": ", ".join(map(str, also_in[id_]))} for id_ in ids]
+            )
     
-    print(f"Banco de dados vetorial criado com sucesso em '{DB_PATH}'.")
+    print(f"\nBanco de dados vetorial criado com sucesso em '{DB_PATH}' com {total_chunks} novos chunks no total.")
     
     return db
 
@@ -740,4 +1108,21 @@ def filter_metadata_dict(metadata_dict):
         else:
             filtered[key] = str(value)
     
-    return filtered
\ No newline at end of file
+    return filtered
+
+
+# Tipos aceitos sem conversão por filter_metadata_dict
+_SIMPLE_METADATA_TYPES = frozenset((str, int, float, bool))
+
+
+def _fast_filter_metadata(metadata):
+    """
+    Equivalente a filter_metadata_dict, com atalho para metadados já simples.
+
+    Quase todos os chunks só têm valores str/int/float/bool; nesse caso basta
+    uma checagem dos tipos e uma cópia do dicionário. Qualquer outro valor
+    (None, listas, subclasses) segue pelo caminho completo de filter_metadata_dict.
+    """
+    if set(map(type, metadata.values())) <= _SIMPLE_METADATA_TYPES:
+        return dict(metadata)
+    return filter_metadata_dict(metadata)
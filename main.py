@@ -2,16 +2,12 @@ import io
 import sys
 import argparse
 from init import load_environment
-from bot import run_bot
-from knowledge import integrate_consumer_law_documents, clear_vector_db
 from init import diagnose_paths
 
 # Força a codificação UTF-8 para entrada/saída
 sys.stdin = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', errors='replace')
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
 
-load_environment()
-
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Sistema RAG de Direito do Consumidor')
     parser.add_argument('--update-only', action='store_true', 
@@ -28,6 +24,10 @@ if __name__ == "__main__":
     load_environment()
     diagnose_paths()
 
+    # Os módulos pesados (LangChain, Chroma, OpenAI) só são importados depois
+    # dos argumentos, e o bot apenas quando vai ser executado
+    from knowledge import integrate_consumer_law_documents, clear_vector_db
+
     # Se solicitado, limpa o banco de dados
     if args.clear_db:
         clear_vector_db()
@@ -45,4 +45,5 @@ if __name__ == "__main__":
     # Se não for apenas atualização, executa o bot
     if not args.update_only:
         print("\nIniciando o assistente de Direito do Consumidor...")
+        from bot import run_bot
         run_bot()
@@ -4,6 +4,7 @@ import os
 import time
 import re
 import json
+from collections import deque
 from datetime import datetime
 from src.init import load_environment
 from src.knowledge import get_or_create_db
@@ -108,47 +109,71 @@ st.markdown("""
 st.markdown('<h1 class="main-header">⚖️ Assistente Virtual de Direito do Consumidor</h1>', unsafe_allow_html=True)
 st.markdown('<p class="sub-header">Tire suas dúvidas sobre direitos do consumidor com base na legislação brasileira atual.</p>', unsafe_allow_html=True)
 
+# Padrões de citações legais, compilados uma única vez (process_citations roda a cada palavra do efeito de digitação)
+# Referências a artigos do CDC
+_ARTICLE_CITATION_RE = re.compile(r'Art\.?\s*(\d+[º°]?[A-Z]?)[.\s-]+([^.]+)')
+# Referências a leis
+_LAW_CITATION_RE = re.compile(r'Lei\s+n[º°.]?\s*([0-9\.]+\/[0-9]+)[.\s-]+([^.]+)')
+# Decretos
+_DECREE_CITATION_RE = re.compile(r'Decreto\s+n[º°.]?\s*([0-9\.]+\/[0-9]+)[.\s-]+([^.]+)')
+
+def _format_citation(match):
+    """Formata uma citação encontrada como bloco HTML de citação legal."""
+    reference = match.group(1)
+    content = match.group(2)
+    
+    # Formata como uma citação legal
+    return f'<div class="legal-citation"><div class="citation-title">{reference}</div><div class="citation-content">{content}</div></div>'
+
+# Efeito de digitação: palavras acrescentadas por quadro e pausa entre quadros (~100 palavras/s)
+_WORDS_PER_FRAME = 8
+_FRAME_DELAY = 0.08
+
+# Fim de frase após o qual nenhuma citação pode continuar: ponto seguido de espaço que
+# não faz parte de um cabeçalho ("Art.", "n.", "18.", "8.078/1990")
+_STABLE_BOUNDARY_RE = re.compile(r'(?<![\dA-Zº°\s.-])(?<!Art)(?<!\sn)\.(?=\s)')
+
+def _stable_boundary(text, start):
+    """Retorna a posição logo após o último fim de frase seguro de text[start:] (ou start)."""
+    end = start
+    for match in _STABLE_BOUNDARY_RE.finditer(text, start):
+        end = match.end()
+    return end
+
 # Função para processar citações legais em texto
 def process_citations(text):
     """
     Identifica e formata citações legais no texto.
     Procura padrões como "Art. X", "Lei n. X", etc.
     """
-    # Padrão para identificar referências a artigos do CDC
-    article_pattern = r'(Art\.?\s*(\d+[º°]?[A-Z]?)[.\s-]+([^.]+))'
-    
-    # Padrão para referências a leis
-    law_pattern = r'(Lei\s+n[º°.]?\s*([0-9\.]+\/[0-9]+)[.\s-]+([^.]+))'
-    
-    # Padrão para decretos
-    decree_pattern = r'(Decreto\s+n[º°.]?\s*([0-9\.]+\/[0-9]+)[.\s-]+([^.]+))'
-    
-    # Substitui padrões por HTML formatado
-    def replace_with_citation(match):
-        full_text = match.group(1)
-        reference = match.group(2)
-        content = match.group(3)
-        
-        # Formata como uma citação legal
-        return f'<div class="legal-citation"><div class="citation-title">{reference}</div><div class="citation-content">{content}</div></div>'
-    
     # Aplica as substituições
-    text = re.sub(article_pattern, replace_with_citation, text)
-    text = re.sub(law_pattern, replace_with_citation, text)
-    text = re.sub(decree_pattern, replace_with_citation, text)
+    text = _ARTICLE_CITATION_RE.sub(_format_citation, text)
+    text = _LAW_CITATION_RE.sub(_format_citation, text)
+    text = _DECREE_CITATION_RE.sub(_format_citation, text)
     
     return text
 
+# Arquivos de feedback: JSONL com um registro por linha, apenas acrescentado,
+# e o formato antigo (lista JSON regravada a cada avaliação)
+FEEDBACK_DIR = "feedback"
+FEEDBACK_FILE = os.path.join(FEEDBACK_DIR, "feedback.jsonl")
+LEGACY_FEEDBACK_FILE = os.path.join(FEEDBACK_DIR, "feedback.json")
+
+def migrate_legacy_feedback():
+    """Converte o feedback.json antigo para JSONL, se ainda não houver arquivo JSONL."""
+    if os.path.exists(FEEDBACK_FILE) or not os.path.exists(LEGACY_FEEDBACK_FILE):
+        return
+    try:
+        with open(LEGACY_FEEDBACK_FILE, 'r', encoding='utf-8') as f:
+            all_feedback = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return
+    with open(FEEDBACK_FILE, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(item, ensure_ascii=False) + "\n" for item in all_feedback)
+
 # Função para salvar feedback
 def save_feedback(question, answer, feedback, comment=""):
-    """Salva o feedback do usuário em um arquivo JSON."""
-    feedback_dir = "feedback"
-    feedback_file = os.path.join(feedback_dir, "feedback.json")
-    
-    # Cria diretório de feedback se não existir
-    if not os.path.exists(feedback_dir):
-        os.makedirs(feedback_dir)
-    
+    """Acrescenta o feedback do usuário ao arquivo JSONL, sem reler os registros anteriores."""
     # Prepara dados de feedback
     feedback_data = {
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
@@ -158,22 +183,74 @@ def save_feedback(question, answer, feedback, comment=""):
         "comment": comment
     }
     
-    # Carrega feedback existente ou cria um novo arquivo
-    if os.path.exists(feedback_file):
-        with open(feedback_file, 'r', encoding='utf-8') as f:
+    # Adiciona novo feedback como uma linha no final do arquivo
+    with open(FEEDBACK_FILE, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(feedback_data, ensure_ascii=False) + "\n")
+
+# Callbacks dos botões de feedback: rodam antes da nova execução do script
+# disparada pelo clique, que já mostra o estado atualizado (sem st.rerun())
+def rate_useful(message_id, question, answer):
+    """Registra a resposta como útil."""
+    st.session_state.feedback[message_id] = "útil"
+    save_feedback(question, answer, "útil")
+
+def rate_not_useful(message_id):
+    """Marca a resposta como não útil e abre o campo de comentário."""
+    st.session_state.feedback[message_id] = "não útil"
+    st.session_state[f"show_comment_{message_id}"] = True
+
+def submit_comment(message_id, question, answer):
+    """Salva o feedback negativo com o comentário digitado."""
+    save_feedback(question, answer, "não útil", st.session_state.get(f"comment_{message_id}", ""))
+    st.session_state[f"show_comment_{message_id}"] = False
+
+def load_feedback():
+    """Lê todos os registros de feedback (linhas inválidas são ignoradas)."""
+    all_feedback = []
+    with open(FEEDBACK_FILE, 'r', encoding='utf-8') as f:
+        for line in f:
             try:
-                all_feedback = json.load(f)
+                all_feedback.append(json.loads(line))
             except json.JSONDecodeError:
-                all_feedback = []
-    else:
-        all_feedback = []
-    
-    # Adiciona novo feedback
-    all_feedback.append(feedback_data)
-    
-    # Salva no arquivo
-    with open(feedback_file, 'w', encoding='utf-8') as f:
-        json.dump(all_feedback, f, ensure_ascii=False, indent=4)
+                continue
+    return all_feedback
+
+def feedback_version():
+    """Identifica o estado do arquivo de feedback (data de modificação e tamanho) para invalidar os caches."""
+    stat = os.stat(FEEDBACK_FILE)
+    return stat.st_mtime_ns, stat.st_size
+
+@st.cache_data
+def feedback_stats(version):
+    """Retorna (total, úteis) do feedback; recalculado só quando `version` muda."""
+    all_feedback = load_feedback()
+    return len(all_feedback), sum(1 for item in all_feedback if item["feedback"] == "útil")
+
+@st.cache_data
+def recent_feedback(version, limit=10):
+    """
+    Retorna os `limit` registros de feedback mais recentes, do mais novo ao mais antigo.
+    Só as últimas linhas do arquivo são decodificadas.
+    """
+    with open(FEEDBACK_FILE, 'r', encoding='utf-8') as f:
+        last_lines = deque(f, maxlen=limit)
+    recent = []
+    for line in reversed(last_lines):
+        try:
+            recent.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return recent
+
+# O diretório de feedback é criado na inicialização; save_feedback só acrescenta ao arquivo
+os.makedirs(FEEDBACK_DIR, exist_ok=True)
+migrate_legacy_feedback()
+
+def append_answer(response, formatted_response):
+    """Adiciona a resposta do assistente ao histórico, com um ID único para controle de feedback."""
+    message_id = f"msg_{int(time.time())}"
+    st.session_state.messages.append({"role": "assistant", "content": response,
+                                      "html": formatted_response, "id": message_id})
 
 # Inicialização do sistema
 @st.cache_resource
@@ -192,13 +269,11 @@ if 'messages' not in st.session_state:
     
     # Inicializa dicionário para controle de feedback
     st.session_state.feedback = {}
-    
-    # Mostrar mensagem de carregamento
-    with st.spinner("Carregando base de conhecimento de legislação..."):
-        # Carregar sistema
-        db, qa_chain = load_system()
-        st.session_state.db = db
-        st.session_state.qa_chain = qa_chain
+
+# Sistema compartilhado por todas as sessões (st.cache_resource): depois da primeira
+# carga a chamada é imediata, e o spinner só aparece quando a carga passa de meio segundo
+with st.spinner("Carregando base de conhecimento de legislação..."):
+    db, qa_chain = load_system()
 
 # Exibe o histórico de mensagens com citações formatadas e opções de feedback
 for idx, message in enumerate(st.session_state.messages):
@@ -207,8 +282,8 @@ for idx, message in enumerate(st.session_state.messages):
     with st.chat_message(message["role"]):
         # Para mensagens do assistente, processa citações
         if message["role"] == "assistant" and message_id != "intro":
-            # Processa citações legais
-            formatted_content = process_citations(message["content"])
+            # Processa citações legais (o HTML é guardado na mensagem quando ela é criada)
+            formatted_content = message.get("html") or process_citations(message["content"])
             st.markdown(formatted_content, unsafe_allow_html=True)
             
             # Adiciona opções de feedback se ainda não foi dado
@@ -217,39 +292,26 @@ for idx, message in enumerate(st.session_state.messages):
                     st.markdown('<div class="feedback-container">', unsafe_allow_html=True)
                     st.markdown('<div class="feedback-question">Esta resposta foi útil?</div>', unsafe_allow_html=True)
                     
+                    # Encontra a pergunta correspondente (mensagem anterior)
+                    question_idx = idx - 1 if idx > 0 else 0
+                    question = st.session_state.messages[question_idx]["content"] if st.session_state.messages[question_idx]["role"] == "user" else ""
+                    
                     col1, col2, col3 = st.columns([1, 1, 4])
                     
                     # Botão de feedback positivo
-                    if col1.button("👍 Sim", key=f"useful_{message_id}"):
-                        st.session_state.feedback[message_id] = "útil"
-                        
-                        # Encontra a pergunta correspondente (mensagem anterior)
-                        question_idx = idx - 1 if idx > 0 else 0
-                        question = st.session_state.messages[question_idx]["content"] if st.session_state.messages[question_idx]["role"] == "user" else ""
-                        
-                        # Salva feedback
-                        save_feedback(question, message["content"], "útil")
-                        st.rerun()
+                    col1.button("👍 Sim", key=f"useful_{message_id}", on_click=rate_useful,
+                                args=(message_id, question, message["content"]))
                     
                     # Botão de feedback negativo
-                    if col2.button("👎 Não", key=f"notuseful_{message_id}"):
-                        st.session_state.feedback[message_id] = "não útil"
-                        st.session_state[f"show_comment_{message_id}"] = True
-                        st.rerun()
+                    col2.button("👎 Não", key=f"notuseful_{message_id}", on_click=rate_not_useful,
+                                args=(message_id,))
                     
                     # Área para comentário (aparece após feedback negativo)
                     if st.session_state.get(f"show_comment_{message_id}", False):
                         with st.container():
-                            comment = st.text_area("Por que esta resposta não foi útil?", key=f"comment_{message_id}")
-                            if st.button("Enviar comentário", key=f"submit_comment_{message_id}"):
-                                # Encontra a pergunta correspondente
-                                question_idx = idx - 1 if idx > 0 else 0
-                                question = st.session_state.messages[question_idx]["content"] if st.session_state.messages[question_idx]["role"] == "user" else ""
-                                
-                                # Salva feedback com comentário
-                                save_feedback(question, message["content"], "não útil", comment)
-                                st.session_state[f"show_comment_{message_id}"] = False
-                                st.rerun()
+                            st.text_area("Por que esta resposta não foi útil?", key=f"comment_{message_id}")
+                            st.button("Enviar comentário", key=f"submit_comment_{message_id}", on_click=submit_comment,
+                                      args=(message_id, question, message["content"]))
                     
                     st.markdown('</div>', unsafe_allow_html=True)
             else:
@@ -274,30 +336,51 @@ if prompt := st.chat_input("Digite sua dúvida sobre direitos do consumidor...")
         message_placeholder = st.empty()
         with st.spinner("Consultando a legislação..."):
             # Gera resposta
-            response = st.session_state.qa_chain.invoke(prompt)
+            response = qa_chain.invoke(prompt)
             
             # Simular efeito de digitação
             full_response = ""
-            for chunk in response.split():
-                full_response += chunk + " "
-                time.sleep(0.01)
+            # Frases já concluídas são formatadas uma única vez; a cada palavra
+            # só o trecho após o último fim de frase é reprocessado
+            stable_html = ""
+            stable_end = 0
+            # A tela é redesenhada uma vez por quadro de _WORDS_PER_FRAME palavras
+            words = response.split()
+            for start in range(0, len(words), _WORDS_PER_FRAME):
+                full_response += " ".join(words[start:start + _WORDS_PER_FRAME]) + " "
+                time.sleep(_FRAME_DELAY)
+                boundary = _stable_boundary(full_response, stable_end)
+                if boundary > stable_end:
+                    stable_html += process_citations(full_response[stable_end:boundary])
+                    stable_end = boundary
                 # Processa citações em tempo real para o efeito de digitação
-                formatted_response = process_citations(full_response + "▌")
+                formatted_response = stable_html + process_citations(full_response[stable_end:] + "▌")
                 message_placeholder.markdown(formatted_response, unsafe_allow_html=True)
             
             # Exibir resposta completa com citações formatadas
             formatted_response = process_citations(response)
             message_placeholder.markdown(formatted_response, unsafe_allow_html=True)
     
-    # Gera ID único para a mensagem para controle de feedback
-    message_id = f"msg_{int(time.time())}"
-    
     # Adiciona resposta ao histórico
-    st.session_state.messages.append({"role": "assistant", "content": response, "id": message_id})
+    append_answer(response, formatted_response)
     
     # Roda o aplicativo novamente para mostrar os controles de feedback
     st.rerun()
 
+# Legislação listada na barra lateral: uma única lista markdown por seção
+LEIS_MD = """\
+- **CDC** - Lei 8.078/90 (Código de Defesa do Consumidor)
+- **Lei n° 9.870/1999** (Mensalidades Escolares)
+- **Lei n° 10.962/2004** (Informação e Precificação)
+- **Lei n° 12.741/2012** (Carga Tributária)
+- **Lei n° 12.291/2010** (Exemplar do CDC)"""
+
+DECRETOS_MD = """\
+- **Decreto n° 5.903/2006** (Precificação)
+- **Decreto n° 7.962/2013** (Comércio Eletrônico)
+- **Resolução CNSP n° 296**
+- **Resolução CNSP n° 434**"""
+
 # Sidebar
 with st.sidebar:
     st.image("https://www.gov.br/pt-br/imagens-de-servicos/defesa-do-consumidor.png/@@images/image", width=100)
@@ -307,27 +390,16 @@ with st.sidebar:
     st.subheader("Legislação Disponível")
     
     with st.expander("📚 Leis", expanded=True):
-        st.markdown("- **CDC** - Lei 8.078/90 (Código de Defesa do Consumidor)")
-        st.markdown("- **Lei n° 9.870/1999** (Mensalidades Escolares)")
-        st.markdown("- **Lei n° 10.962/2004** (Informação e Precificação)")
-        st.markdown("- **Lei n° 12.741/2012** (Carga Tributária)")
-        st.markdown("- **Lei n° 12.291/2010** (Exemplar do CDC)")
+        st.markdown(LEIS_MD)
     
     with st.expander("📃 Decretos e Resoluções"):
-        st.markdown("- **Decreto n° 5.903/2006** (Precificação)")
-        st.markdown("- **Decreto n° 7.962/2013** (Comércio Eletrônico)")
-        st.markdown("- **Resolução CNSP n° 296**")
-        st.markdown("- **Resolução CNSP n° 434**")
+        st.markdown(DECRETOS_MD)
     
     # Estatísticas de feedback
-    if os.path.exists("feedback/feedback.json"):
+    if os.path.exists(FEEDBACK_FILE):
         try:
-            with open("feedback/feedback.json", 'r', encoding='utf-8') as f:
-                all_feedback = json.load(f)
-            
-            # Calcula estatísticas
-            total_feedback = len(all_feedback)
-            positive_feedback = sum(1 for item in all_feedback if item["feedback"] == "útil")
+            # Calcula estatísticas (em cache até o arquivo mudar)
+            total_feedback, positive_feedback = feedback_stats(feedback_version())
             
             # Mostra estatísticas
             st.subheader("Estatísticas de Feedback")
@@ -347,50 +419,30 @@ with st.sidebar:
     # Exemplos de perguntas
     st.subheader("Exemplos de perguntas")
     
-    exemplo1 = "Qual o prazo para devolução de produtos com defeito?"
-    exemplo2 = "Quais são meus direitos em caso de atraso na entrega?"
-    exemplo3 = "Posso cancelar uma compra feita pela internet?"
-    
-    col1, col2, col3 = st.columns(3)
+    exemplos = [
+        "Qual o prazo para devolução de produtos com defeito?",
+        "Quais são meus direitos em caso de atraso na entrega?",
+        "Posso cancelar uma compra feita pela internet?",
+    ]
     
-    if col1.button("Exemplo 1"):
-        st.session_state.messages.append({"role": "user", "content": exemplo1})
-        with st.spinner("Processando..."):
-            response = st.session_state.qa_chain.invoke(exemplo1)
-            message_id = f"msg_{int(time.time())}"
-            st.session_state.messages.append({"role": "assistant", "content": response, "id": message_id})
-        st.rerun()
-        
-    if col2.button("Exemplo 2"):
-        st.session_state.messages.append({"role": "user", "content": exemplo2})
-        with st.spinner("Processando..."):
-            response = st.session_state.qa_chain.invoke(exemplo2)
-            message_id = f"msg_{int(time.time())}"
-            st.session_state.messages.append({"role": "assistant", "content": response, "id": message_id})
-        st.rerun()
-        
-    if col3.button("Exemplo 3"):
-        st.session_state.messages.append({"role": "user", "content": exemplo3})
-        with st.spinner("Processando..."):
-            response = st.session_state.qa_chain.invoke(exemplo3)
-            message_id = f"msg_{int(time.time())}"
-            st.session_state.messages.append({"role": "assistant", "content": response, "id": message_id})
-        st.rerun()
+    for i, (col, exemplo) in enumerate(zip(st.columns(len(exemplos)), exemplos), start=1):
+        if col.button(f"Exemplo {i}"):
+            st.session_state.messages.append({"role": "user", "content": exemplo})
+            with st.spinner("Processando..."):
+                response = qa_chain.invoke(exemplo)
+                append_answer(response, process_citations(response))
+            st.rerun()
     
     # Visualização de feedback (apenas para admins ou desenvolvedores)
     with st.expander("👁️ Acessar Feedback Detalhado", expanded=False):
         if st.checkbox("Mostrar feedback detalhado"):
-            if os.path.exists("feedback/feedback.json"):
+            if os.path.exists(FEEDBACK_FILE):
                 try:
-                    with open("feedback/feedback.json", 'r', encoding='utf-8') as f:
-                        feedback_data = json.load(f)
+                    # Mostra dados mais recentes primeiro, limitados a 10 itens para não sobrecarregar
+                    feedback_data = recent_feedback(feedback_version())
                     
                     if feedback_data:
-                        # Mostra dados mais recentes primeiro
-                        for idx, item in enumerate(reversed(feedback_data)):
-                            if idx > 9:  # Limita a 10 itens para não sobrecarregar
-                                break
-                                
+                        for item in feedback_data:
                             st.markdown(f"**Data:** {item['timestamp']}")
                             st.markdown(f"**Pergunta:** {item['question']}")
                             st.markdown(f"**Resposta:** {item['answer'][:100]}...")